@@ -0,0 +1,25 @@
+# - Настройки gunicorn -
+# gevent-воркер: ожидание ответа Yandex GPT и PostgreSQL не занимает
+# отдельный поток на каждого пользователя
+import os
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+# Один воркер: база знаний, меню и кэши живут в памяти процесса,
+# несколько воркеров разошлись бы после правок в админке
+workers = int(os.getenv("GUNICORN_WORKERS", "1"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+# Для GUNICORN_WORKER_CLASS=gthread (без gevent): потоков на воркер
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+timeout = 60
+
+
+def post_fork(server, worker):
+    """Делает psycopg2 совместимым с gevent до создания пула подключений"""
+    if worker_class != "gevent":
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+        server.log.info("✅ psycopg2 переключен на gevent")
+    except ImportError:
+        server.log.warning("⚠️ psycogreen не установлен, запросы к PostgreSQL блокируют воркер")
@@ -0,0 +1,137 @@
+# - Регрессионные тесты web_app -
+# Запуск из корня репозитория: python -m unittest discover tests
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_FILES = ["knowledge_base.json", "menu.json", "menu_categories.json", "suggestions.json"]
+
+# web_app читает и пишет файлы данных относительно текущей папки:
+# работаем в копии, чтобы тесты не трогали файлы репозитория
+_WORKDIR = tempfile.mkdtemp(prefix="web_app_test_")
+for name in DATA_FILES:
+    shutil.copy(os.path.join(ROOT, name), _WORKDIR)
+os.environ.pop("DATABASE_URL", None)
+os.chdir(_WORKDIR)
+sys.path.insert(0, ROOT)
+
+import web_app  # noqa: E402
+
+
+def tearDownModule():
+    web_app.flush_jsonl()
+    os.chdir(ROOT)
+    shutil.rmtree(_WORKDIR, ignore_errors=True)
+
+
+class AdminFlashTest(unittest.TestCase):
+    def setUp(self):
+        self.client = web_app.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["admin_logged_in"] = True
+            sess["admin_user"] = "admin"
+
+    def test_flash_after_redirect(self):
+        """Сообщение flash переживает редирект через cookie-сессию"""
+        response = self.client.get("/admin/menu/delete/999", follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Неверный индекс кнопки", response.get_data(as_text=True))
+
+
+class KnowledgeImportTest(unittest.TestCase):
+    def setUp(self):
+        self.client = web_app.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["admin_logged_in"] = True
+            sess["admin_user"] = "admin"
+
+    def test_rejects_non_object(self):
+        for body in ([["вопрос", "ответ"]], "текст", 42):
+            with self.subTest(body=body):
+                response = self.client.post("/admin/knowledge/import", json=body)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.get_json()["success"])
+
+
+class KnowledgeBaseSearchTest(unittest.TestCase):
+    # Вопрос пользователя -> вопрос базы знаний, чей ответ он должен получить
+    QUERIES = {
+        "болит зуб что делать": "у меня болит зуб",
+        "запись к врачу": "как записаться к врачу на платный прием?",
+        "анестезия не сработала": "правда, что анестезия может не сработать",
+        "врач ортопед повторный прием": "как записаться на повторный прием к врачу-ортопеду?",
+    }
+
+    def assert_queries_found(self):
+        web_app._find_in_knowledge_base.cache_clear()
+        for question, kb_question in self.QUERIES.items():
+            with self.subTest(question=question):
+                self.assertEqual(web_app.find_in_knowledge_base(question),
+                                 web_app.KNOWLEDGE_BASE[kb_question])
+
+    def test_fuzzy_search(self):
+        self.assert_queries_found()
+
+    def test_word_overlap_without_rapidfuzz(self):
+        original = web_app.RAPIDFUZZ_AVAILABLE
+        web_app.RAPIDFUZZ_AVAILABLE = False
+        try:
+            self.assert_queries_found()
+        finally:
+            web_app.RAPIDFUZZ_AVAILABLE = original
+            web_app._find_in_knowledge_base.cache_clear()
+
+    def test_lookup_during_rebuild_does_not_stick(self):
+        """Поиск, начатый до перестройки индекса, не оставляет в кэше старый ответ"""
+        question = "болит зуб что делать"
+        kb_question = self.QUERIES[question]
+        old_version = web_app._KB_INDEX_VERSION
+        old_answer = web_app.KNOWLEDGE_BASE[kb_question]
+        with web_app._KB_LOCK:
+            web_app.KNOWLEDGE_BASE[kb_question] = "новый ответ"
+            web_app._rebuild_kb_index()
+        try:
+            # Запоздавший поиск по старой сборке кэширует старый ответ
+            web_app._find_in_knowledge_base(question, old_version)
+            self.assertEqual(web_app.find_in_knowledge_base(question), "новый ответ")
+        finally:
+            with web_app._KB_LOCK:
+                web_app.KNOWLEDGE_BASE[kb_question] = old_answer
+                web_app._rebuild_kb_index()
+
+
+class ChatTtsTextTest(unittest.TestCase):
+    def setUp(self):
+        self.client = web_app.app.test_client()
+        self.question = next(iter(web_app.KNOWLEDGE_BASE))
+
+    def test_tts_text_only_when_speaking(self):
+        response = self.client.post("/chat", json={"message": self.question})
+        self.assertNotIn("tts_text", response.get_json())
+
+    def test_tts_text_is_cleaned_answer(self):
+        # Предварительный синтез не должен ходить в SpeechKit из тестов
+        original = web_app.prefetch_tts
+        web_app.prefetch_tts = lambda tts_text, voice="alena": None
+        try:
+            response = self.client.post("/chat", json={"message": self.question, "speak": True})
+        finally:
+            web_app.prefetch_tts = original
+        payload = response.get_json()
+        self.assertEqual(payload["tts_text"], web_app.tts_text_for_answer(payload["response"]))
+
+    def test_answer_cleanup(self):
+        text = web_app.tts_text_for_answer(
+            "**Запись** 01.02.2025: [портал](http://www.mos.ru/services), цена 1.5 тыс. #приём"
+        )
+        self.assertEqual(
+            text,
+            "Запись первое февраля две тысячи двадцать пятого года: портал, цена 1 точка 5 тыс. приём"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
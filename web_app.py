@@ -1,16 +1,31 @@
 # web_app.py
 from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, send_from_directory, abort, make_response, Response
+from flask.json.provider import DefaultJSONProvider
+from jinja2 import FileSystemBytecodeCache
 import os
+import io
 import json
 import time
+import random
 import shutil
 from datetime import datetime
 from dotenv import load_dotenv
+from cachetools import TTLCache
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import socket
 import logging
 import re
 import functools
+import itertools
+import collections
+import hashlib
+import threading
+import queue
+import concurrent.futures
+import atexit
+from contextlib import contextmanager
 from urllib.parse import unquote, quote
 
 
@@ -26,16 +41,42 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "super-secret-key-for-d-space-bot")
 
-# - ОТКЛЮЧЕНИЕ КЭШИРОВАНИЯ -
-app.config['TEMPLATES_AUTO_RELOAD'] = True
-app.jinja_env.auto_reload = True
-app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
+# - КЭШИРОВАНИЕ ШАБЛОНОВ И СТАТИКИ -
+# Автоперезагрузка шаблонов и отключенный кэш статики нужны только при разработке
+DEV_MODE = (os.getenv("FLASK_ENV") == "development"
+            or os.getenv("FLASK_DEBUG", "false").lower() == "true")
+if DEV_MODE:
+    app.config['TEMPLATES_AUTO_RELOAD'] = True
+    app.jinja_env.auto_reload = True
+    app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
+else:
+    app.config['TEMPLATES_AUTO_RELOAD'] = False
+    app.jinja_env.auto_reload = False
+    # Файлы статики без версий в URL, поэтому кэшируем на час, а не навсегда
+    app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 3600
+    # Скомпилированные шаблоны сохраняются между перезапусками
+    JINJA_CACHE_DIR = ".jinja_cache"
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR, '%s.cache')
 
 # - Глобальные переменные -
 KNOWLEDGE_BASE = {}
+_KB_NORM = {}  # нормализованный вопрос -> (исходный вопрос, ответ, порядковый номер)
+_KB_INVERTED = {}  # слово -> список нормализованных вопросов с этим словом
+_KB_KEYS_NORM = []  # нормализованные вопросы в порядке базы (для rapidfuzz)
+_KB_INDEX_VERSION = 0  # номер сборки индекса, входит в ключ кэша поиска
+# Изменения KNOWLEDGE_BASE и его индексов выполняются под этой блокировкой;
+# чтение обходится без нее (индексы подменяются целиком)
+_KB_LOCK = threading.RLock()
+# Была правка через админку: странице базы знаний нужно перечитать ее из БД
+_KB_RELOAD_NEEDED = False
 BOOKINGS = []
 conversation_history = {}
-LOG_FILE = "bot_log.json"
+LOG_FILE = "bot_log.jsonl"
+LEGACY_LOG_FILE = "bot_log.json"
+FEEDBACK_FILE = "feedback.jsonl"
+LOGS_VIEW_LIMIT = 500  # сколько последних диалогов показывать в админке
+LEGACY_FEEDBACK_FILE = "feedback.json"
 BACKUPS_DIR = "backups"
 os.makedirs(BACKUPS_DIR, exist_ok=True)
 
@@ -46,107 +87,395 @@ SUGGESTIONS_FILE = "suggestions.json"
 MENU_FILE = "menu.json"
 MENU_CATEGORIES_FILE = "menu_categories.json"
 
+# - Работа с JSON-файлами: orjson (быстрее) или стандартный json -
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+def read_json_file(path):
+    """Читает JSON-файл"""
+    if ORJSON_AVAILABLE:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def write_json_file(path, data, indent=True):
+    """Атомарно записывает данные в JSON-файл без экранирования кириллицы.
+    Отступы только для файлов, которые читают и правят люди (indent=True)"""
+    # Пишем во временный файл и подменяем им основной, чтобы при сбое
+    # на диске не остался обрезанный JSON
+    tmp_path = path + ".tmp"
+    if ORJSON_AVAILABLE:
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0))
+    else:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2 if indent else None)
+    os.replace(tmp_path, path)
+
+# - Файлы JSON Lines: одна запись на строку, только дозапись -
+_JSONL_LOCK = threading.Lock()
+_JSONL_FILES = {}  # путь -> открытый буферизованный файл для дозаписи
+
+def _dump_jsonl_line(entry):
+    """Сериализует запись в одну строку JSON"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(entry) + b"\n"
+    return json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n"
+
+def append_jsonl(path, entry, flush=False):
+    """Дописывает запись в JSONL-файл; на диск попадает при заполнении буфера,
+    flush_jsonl или сразу, если flush=True"""
+    line = _dump_jsonl_line(entry)
+    with _JSONL_LOCK:
+        fh = _JSONL_FILES.get(path)
+        if fh is None:
+            fh = _JSONL_FILES[path] = open(path, "ab", buffering=64 * 1024)
+        fh.write(line)
+        if flush:
+            fh.flush()
+
+def flush_jsonl(path=None):
+    """Сбрасывает буферы JSONL-файлов на диск (всех или одного)"""
+    with _JSONL_LOCK:
+        for fh_path, fh in _JSONL_FILES.items():
+            if path is None or fh_path == path:
+                fh.flush()
+
+def read_jsonl(path, limit=None):
+    """Читает записи JSONL-файла: все или только последние limit"""
+    flush_jsonl(path)
+    entries = []
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            # deque с maxlen проходит файл потоком и держит в памяти только хвост
+            lines = collections.deque(f, maxlen=limit) if limit else f
+            for line in lines:
+                line = line.strip()
+                if line:
+                    entries.append(orjson.loads(line) if ORJSON_AVAILABLE else json.loads(line))
+    return entries
+
+def migrate_json_to_jsonl(legacy_path, path):
+    """Переносит старый JSON-массив в JSONL-файл, оригинал уходит в резервные копии"""
+    if not os.path.exists(legacy_path):
+        return
+    try:
+        entries = read_json_file(legacy_path) or []
+        with open(path, "ab") as f:
+            for entry in entries:
+                f.write(_dump_jsonl_line(entry))
+        name = os.path.splitext(os.path.basename(legacy_path))[0]
+        os.replace(legacy_path, os.path.join(BACKUPS_DIR, f"{name}_legacy_{int(time.time())}.json"))
+        print(f"✅ {legacy_path} перенесен в {path} ({len(entries)} записей)")
+    except Exception as e:
+        print(f"❌ Ошибка переноса {legacy_path}: {e}")
+
+atexit.register(flush_jsonl)
+
+if ORJSON_AVAILABLE:
+    class OrjsonProvider(DefaultJSONProvider):
+        """JSON-провайдер Flask на orjson: jsonify и request.json без стандартного json"""
+
+        def _option(self, indent=False):
+            # Даты отдаем в default, чтобы формат остался как у Flask (HTTP-дата)
+            option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            if indent:
+                option |= orjson.OPT_INDENT_2
+            return option
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=self.default, option=self._option(kwargs.get("indent"))).decode("utf-8")
+
+        def loads(self, s, **kwargs):
+            # Сессия Flask декодируется с object_hook (теги flash и т.п.) - orjson его не умеет
+            if kwargs:
+                return super().loads(s, **kwargs)
+            return orjson.loads(s)
+
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            indent = (self.compact is None and self._app.debug) or self.compact is False
+            return self._app.response_class(
+                orjson.dumps(obj, default=self.default, option=self._option(indent)),
+                mimetype=self.mimetype
+            )
+
+    app.json = OrjsonProvider(app)
+
+# Компактный JSON в ответах, в том числе в режиме отладки
+app.json.compact = True
+
 # - Константы системных категорий меню -
 SYSTEM_CATEGORIES = ['attractions', 'events', 'services', 'info']
+# Ключ категории: латиница в нижнем регистре, цифры и подчеркивание
+# (\Z вместо $, чтобы не пропустить завершающий перевод строки)
+_CATEGORY_KEY_RE = re.compile(r'^[a-z0-9_]+\Z')
 
 # - Глобальная переменная -
 suggestionMap = {}
 MENU_CACHE = None
+MENU_CATEGORIES_CACHE = None
+_MENU_BY_NORMQ = {}  # нормализованный вопрос -> кнопка меню
+_MENU_BY_CATEGORY = {}  # категория -> кнопки меню этой категории
+_MENU_BY_ADMIN_TEXT = {}  # текст для админки -> индексы кнопок в меню
+_MENU_BY_QUESTION = {}  # вопрос кнопки -> индексы кнопок в меню
+_SUGG_BY_TOPIC_NORMQ = {}  # тема -> нормализованный вопрос -> подсказка
+_SUGG_BY_NORMQ = {}  # нормализованный вопрос -> первая подсказка среди всех тем
+_SUGG_POS_BY_TOPIC_TEXT = {}  # тема -> текст подсказки -> позиция в списке темы
+_SUGG_TOPIC_PAYLOADS = {}  # тема -> (готовый JSON ответа /suggestions/<topic>, ETag)
+_SUGG_DEFAULT_PAYLOAD = (b'{"suggestions":[]}', "")
+SUGGESTION_VIEW = []  # [(тема, [(текст, вопрос, ответ), ...]), ...] для шаблона админки
+
+# - Кэш ответов Yandex GPT (вопрос -> ответ, живет час) -
+_GPT_CACHE = TTLCache(maxsize=1024, ttl=3600)
+_GPT_CACHE_LOCK = threading.Lock()
+
+# - Общая HTTP-сессия для API Yandex: keep-alive без TLS-рукопожатия на каждый вызов -
+# Повторяем только установку соединения: повторы ответов делает call_yandex_gpt
+_HTTP = requests.Session()
+_HTTP.headers["Connection"] = "keep-alive"
+_HTTP.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(total=2, read=0, status=0, backoff_factor=0.2)
+))
+
+# - Повторы Yandex GPT: экспоненциальная пауза с полным джиттером (сек) -
+GPT_ATTEMPTS = 3
+GPT_RETRY_BASE = 0.25
+GPT_RETRY_CAP = 4.0
 
 # --- Умная система базы знаний: PostgreSQL или файловая ---
 # --- Умная система базы знаний: PostgreSQL или файловая ---
 try:
     import psycopg2
-    from psycopg2.extras import RealDictCursor
+    from psycopg2 import pool
+    from psycopg2.extras import RealDictCursor, execute_values
     import urllib.parse as urlparse
+
+    class KBConnection(psycopg2.extensions.connection):
+        """Подключение пула, помнящее, подготовлены ли на нем запросы базы знаний"""
+        kb_prepared = False
+
     POSTGRES_AVAILABLE = True
     print("✅ psycopg2 доступен")
 except ImportError as e:
     POSTGRES_AVAILABLE = False
     print(f"ℹ️  psycopg2 не установлен: {e}, используем файловую базу знаний")
 
-def get_db_connection():
-    """Создает подключение к PostgreSQL с улучшенной диагностикой"""
+# Пул соединений с PostgreSQL (создается один раз на процесс)
+_PG_POOL = None
+_PG_POOL_LOCK = threading.Lock()
+# ThreadedConnectionPool при нехватке соединений сразу бросает PoolError:
+# семафор на maxconn заставляет лишние запросы (гринлеты gevent) ждать очереди
+_PG_POOL_SLOTS = None
+PG_POOL_WAIT = 30  # сек: сколько запрос ждет свободное соединение
+_KB_SCHEMA_READY = False
+
+# Частые запросы базы знаний: готовятся на сервере один раз на подключение,
+# дальше выполняются через EXECUTE без повторного разбора и планирования
+_KB_STATEMENTS = {
+    "kb_select_all": ("", "SELECT question, answer FROM knowledge_base ORDER BY question"),
+    "kb_upsert": ("(text, text, text)", """
+        INSERT INTO knowledge_base (question, answer, created_by)
+        VALUES ($1, $2, $3)
+        ON CONFLICT (question)
+        DO UPDATE SET
+            answer = EXCLUDED.answer,
+            updated_at = CURRENT_TIMESTAMP
+    """),
+    "kb_delete": ("(text)", "DELETE FROM knowledge_base WHERE question = $1"),
+}
+_PG_PARAM_RE = re.compile(r'\$\d+')
+
+def get_database_url():
+    """Возвращает DATABASE_URL с параметрами SSL для Render.com"""
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        return None
+    # Для Render.com добавляем SSL параметры
+    if 'render.com' in database_url and 'sslmode' not in database_url:
+        if '?' in database_url:
+            database_url += '&sslmode=require'
+        else:
+            database_url += '?sslmode=require'
+    return database_url
+
+def init_db_pool():
+    """Создает пул соединений с PostgreSQL"""
+    global _PG_POOL, _PG_POOL_SLOTS
     if not POSTGRES_AVAILABLE:
-        print("❌ POSTGRES_AVAILABLE = False")
         return None
-        
-    try:
-        database_url = os.getenv('DATABASE_URL')
-        
+
+    with _PG_POOL_LOCK:
+        if _PG_POOL is not None:
+            return _PG_POOL
+
+        database_url = get_database_url()
         # Если DATABASE_URL не установлен, используем файловую базу
         if not database_url:
             print("❌ DATABASE_URL не установлен")
             return None
-            
-        print(f"🔧 DATABASE_URL получен, длина: {len(database_url)}")
-        
-        # Для Render.com добавляем SSL параметры
-        if 'render.com' in database_url and 'sslmode' not in database_url:
-            if '?' in database_url:
-                database_url += '&sslmode=require'
-            else:
-                database_url += '?sslmode=require'
-            print("🔧 Добавлен sslmode=require")
-        
-        # Пробуем подключиться с таймаутом
-        print("🔧 Пытаемся подключиться к PostgreSQL...")
-        conn = psycopg2.connect(
-            database_url,
-            connect_timeout=10
-        )
-        print("✅ Подключение к PostgreSQL успешно")
-        return conn
-        
+
+        try:
+            print("🔧 Создаем пул подключений к PostgreSQL...")
+            maxconn = int(os.getenv("PG_POOL_MAX", "10"))
+            _PG_POOL = pool.ThreadedConnectionPool(
+                minconn=1,
+                maxconn=maxconn,
+                dsn=database_url,
+                connect_timeout=10,
+                connection_factory=KBConnection
+            )
+            _PG_POOL_SLOTS = threading.BoundedSemaphore(maxconn)
+            print("✅ Пул подключений к PostgreSQL создан")
+        except Exception as e:
+            print(f"❌ Критическая ошибка подключения к PostgreSQL: {e}")
+            # Подробная диагностика ошибки
+            import traceback
+            print(f"🔍 Детали ошибки: {traceback.format_exc()}")
+            _PG_POOL = None
+            return None
+
+    # Схему создаем сразу на первом соединении пула, до первого запроса
+    init_knowledge_db()
+    return _PG_POOL
+
+def get_db_connection():
+    """Берет подключение к PostgreSQL из пула"""
+    if not POSTGRES_AVAILABLE:
+        return None
+
+    db_pool = _PG_POOL or init_db_pool()
+    if db_pool is None:
+        return None
+
+    if not _PG_POOL_SLOTS.acquire(timeout=PG_POOL_WAIT):
+        print(f"❌ Нет свободного подключения к PostgreSQL за {PG_POOL_WAIT} сек")
+        return None
+    try:
+        return db_pool.getconn()
     except Exception as e:
-        print(f"❌ Критическая ошибка подключения к PostgreSQL: {e}")
-        # Подробная диагностика ошибки
-        import traceback
-        print(f"🔍 Детали ошибки: {traceback.format_exc()}")
+        _PG_POOL_SLOTS.release()
+        print(f"❌ Ошибка получения подключения из пула: {e}")
         return None
-    
-    
-def init_knowledge_db():
-    """Создает таблицу для базы знаний при первом запуске"""
-    database_url = os.getenv('DATABASE_URL')
-    if not database_url:
-        print("ℹ️  DATABASE_URL не найден, используем файловую базу знаний")
-        return False
-        
+
+def release_db_connection(conn):
+    """Возвращает подключение в пул"""
+    if conn is None or _PG_POOL is None:
+        return
+    try:
+        # Разорванные соединения закрываем, чтобы пул создал новые
+        _PG_POOL.putconn(conn, close=bool(conn.closed))
+    except Exception as e:
+        print(f"❌ Ошибка возврата подключения в пул: {e}")
+    finally:
+        _PG_POOL_SLOTS.release()
+
+@contextmanager
+def pg_conn():
+    """Контекстный менеджер: подключение из пула (или None) с гарантированным возвратом"""
     conn = get_db_connection()
-    if not conn:
-        return False
-        
+    if conn:
+        _prepare_kb_statements(conn)
+    try:
+        yield conn
+    finally:
+        release_db_connection(conn)
+
+def _prepare_kb_statements(conn):
+    """Готовит запросы _KB_STATEMENTS на подключении, если еще не готовы"""
+    if getattr(conn, "kb_prepared", True) or not _KB_SCHEMA_READY:
+        return
     try:
         cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS knowledge_base (
-                id SERIAL PRIMARY KEY,
-                question TEXT UNIQUE NOT NULL,
-                answer TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                created_by VARCHAR(255) DEFAULT 'system'
-            )
-        """)
-        
-        # Создаем индекс для быстрого поиска
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_knowledge_base_question 
-            ON knowledge_base (question)
-        """)
-        
+        cur.execute("DEALLOCATE ALL")
+        for name, (args, sql) in _KB_STATEMENTS.items():
+            cur.execute(f"PREPARE {name}{args} AS {sql}")
         conn.commit()
         cur.close()
-        conn.close()
-        print("✅ Таблица knowledge_base готова в PostgreSQL")
-        return True
+        conn.kb_prepared = True
     except Exception as e:
-        print(f"❌ Ошибка инициализации БД: {e}")
-        return False
+        conn.rollback()
+        print(f"⚠️ Не удалось подготовить запросы базы знаний: {e}")
+
+def kb_execute(cur, name, params=None):
+    """Выполняет запрос из _KB_STATEMENTS: через EXECUTE, если он подготовлен"""
+    args, sql = _KB_STATEMENTS[name]
+    if getattr(cur.connection, "kb_prepared", False):
+        if params:
+            cur.execute(f"EXECUTE {name}({', '.join(['%s'] * len(params))})", params)
+        else:
+            cur.execute(f"EXECUTE {name}")
+    else:
+        cur.execute(_PG_PARAM_RE.sub("%s", sql), params)
     
-
     
+def init_knowledge_db():
+    """Создает таблицу для базы знаний через пул при его создании"""
+    global _KB_SCHEMA_READY
+    with pg_conn() as conn:
+        if not conn:
+            return False
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS knowledge_base (
+                    id SERIAL PRIMARY KEY,
+                    question TEXT UNIQUE NOT NULL,
+                    answer TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    created_by VARCHAR(255) DEFAULT 'system'
+                )
+            """)
+        
+            # Создаем индекс для быстрого поиска
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_knowledge_base_question 
+                ON knowledge_base (question)
+            """)
+        
+            # Полнотекстовый индекс по вопросам для search_knowledge
+            cur.execute("""
+                ALTER TABLE knowledge_base
+                ADD COLUMN IF NOT EXISTS question_tsv tsvector
+                GENERATED ALWAYS AS (to_tsvector('russian', question)) STORED
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_knowledge_base_question_tsv
+                ON knowledge_base USING GIN (question_tsv)
+            """)
+        
+            conn.commit()
+            
+            # Триграммный индекс для ILIKE '%...%' в search_knowledge;
+            # расширение может быть недоступно без прав, таблица от этого не зависит
+            try:
+                cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_knowledge_base_question_trgm
+                    ON knowledge_base USING GIN (question gin_trgm_ops)
+                """)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"⚠️ Триграммный индекс не создан: {e}")
+            
+            cur.close()
+            print("✅ Таблица knowledge_base готова в PostgreSQL")
+            _KB_SCHEMA_READY = True
+            return True
+        except Exception as e:
+            print(f"❌ Ошибка инициализации БД: {e}")
+            return False
+
 def get_default_knowledge():
     """Возвращает базовую базу знаний"""
     return {
@@ -158,209 +487,294 @@ def get_default_knowledge():
 def load_knowledge_base():
     """Загружает базу знаний из PostgreSQL или файла"""
     global KNOWLEDGE_BASE
-    
-    # Пытаемся загрузить из PostgreSQL
-    conn = get_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            cur.execute("SELECT question, answer FROM knowledge_base ORDER BY question")
-            rows = cur.fetchall()
-            KNOWLEDGE_BASE = {row['question']: row['answer'] for row in rows}
-            print(f"✅ База знаний загружена из PostgreSQL ({len(KNOWLEDGE_BASE)} записей)")
-            cur.close()
-            conn.close()
-            return
-        except Exception as e:
-            print(f"❌ Ошибка загрузки из PostgreSQL: {e}")
-    
-    # Если PostgreSQL недоступен, загружаем из файла
-    if os.path.exists(KNOWLEDGE_FILE):
-        try:
-            with open(KNOWLEDGE_FILE, "r", encoding="utf-8") as f:
-                KNOWLEDGE_BASE = json.load(f)
-            print(f"✅ База знаний загружена из файла ({len(KNOWLEDGE_BASE)} записей)")
-        except Exception as e:
-            print(f"❌ Ошибка загрузки из файла: {e}")
+    # Старые ключи больше не нужны в кэше нормализации
+    normalize_text.cache_clear()
+    # Дописываем отложенные изменения, чтобы не перечитать устаревший файл
+    _flush_kb_to_disk()
+    
+    # Блокировка не дает правкам из админки пересечься с перезагрузкой
+    with _KB_LOCK:
+        # Пытаемся загрузить из PostgreSQL
+        with pg_conn() as conn:
+            if conn:
+                try:
+                    cur = conn.cursor(cursor_factory=RealDictCursor)
+                    kb_execute(cur, "kb_select_all")
+                    rows = cur.fetchall()
+                    KNOWLEDGE_BASE = {row['question']: row['answer'] for row in rows}
+                    print(f"✅ База знаний загружена из PostgreSQL ({len(KNOWLEDGE_BASE)} записей)")
+                    cur.close()
+                    _rebuild_kb_index()
+                    return
+                except Exception as e:
+                    print(f"❌ Ошибка загрузки из PostgreSQL: {e}")
+    
+        # Если PostgreSQL недоступен, загружаем из файла
+        if os.path.exists(KNOWLEDGE_FILE):
+            try:
+                KNOWLEDGE_BASE = read_json_file(KNOWLEDGE_FILE)
+                print(f"✅ База знаний загружена из файла ({len(KNOWLEDGE_BASE)} записей)")
+            except Exception as e:
+                print(f"❌ Ошибка загрузки из файла: {e}")
+                KNOWLEDGE_BASE = get_default_knowledge()
+        else:
             KNOWLEDGE_BASE = get_default_knowledge()
-    else:
-        KNOWLEDGE_BASE = get_default_knowledge()
-        # Сохраняем дефолтную базу в файл
-        try:
-            with open(KNOWLEDGE_FILE, "w", encoding="utf-8") as f:
-                json.dump(KNOWLEDGE_BASE, f, ensure_ascii=False, indent=4)
-            print("✅ Создана файловая база знаний по умолчанию")
-        except Exception as e:
-            print(f"❌ Ошибка создания файла: {e}")
+            # Сохраняем дефолтную базу в файл
+            try:
+                write_json_file(KNOWLEDGE_FILE, KNOWLEDGE_BASE)
+                print("✅ Создана файловая база знаний по умолчанию")
+            except Exception as e:
+                print(f"❌ Ошибка создания файла: {e}")
+        _rebuild_kb_index()
 
 def save_knowledge_base():
     """Сохраняет базу знаний в PostgreSQL или файл"""
     # Пытаемся сохранить в PostgreSQL
-    conn = get_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor()
-            cur.execute("DELETE FROM knowledge_base")
+    with pg_conn() as conn:
+        if conn:
+            try:
+                cur = conn.cursor()
+                # Словарь убирает дубликаты ключей после нормализации регистра
+                rows = {question.strip().lower(): answer.strip() for question, answer in KNOWLEDGE_BASE.items()}
             
-            for question, answer in KNOWLEDGE_BASE.items():
-                cur.execute(
-                    "INSERT INTO knowledge_base (question, answer) VALUES (%s, %s)",
-                    (question.strip().lower(), answer.strip())
-                )
+                # Удаляем только те вопросы, которых больше нет в базе
+                cur.execute("SELECT question FROM knowledge_base")
+                removed = [row[0] for row in cur.fetchall() if row[0] not in rows]
+                if removed:
+                    cur.execute("DELETE FROM knowledge_base WHERE question = ANY(%s)", (removed,))
             
-            conn.commit()
-            cur.close()
-            conn.close()
-            print("✅ База знаний сохранена в PostgreSQL")
-            return True
-        except Exception as e:
-            print(f"❌ Ошибка сохранения в PostgreSQL: {e}")
+                # Все записи одним пакетным UPSERT вместо INSERT на каждую строку
+                execute_values(cur, """
+                    INSERT INTO knowledge_base (question, answer) VALUES %s
+                    ON CONFLICT (question)
+                    DO UPDATE SET
+                        answer = EXCLUDED.answer,
+                        updated_at = CURRENT_TIMESTAMP
+                """, list(rows.items()), page_size=500)
+            
+                conn.commit()
+                cur.close()
+                print("✅ База знаний сохранена в PostgreSQL")
+                return True
+            except Exception as e:
+                print(f"❌ Ошибка сохранения в PostgreSQL: {e}")
     
     # Сохраняем в файл
     try:
-        with open(KNOWLEDGE_FILE, "w", encoding="utf-8") as f:
-            json.dump(KNOWLEDGE_BASE, f, ensure_ascii=False, indent=4)
+        write_json_file(KNOWLEDGE_FILE, KNOWLEDGE_BASE)
         print("✅ База знаний сохранена в файл")
         return True
     except Exception as e:
         print(f"❌ Ошибка сохранения в файл: {e}")
         return False
 
+# - Отложенная запись файла базы знаний -
+# Правки из админки помечают файл "грязным", а фоновый поток раз в
+# KB_FLUSH_DELAY секунд записывает его целиком, объединяя серию изменений
+KB_FLUSH_DELAY = 2
+_KB_DIRTY = threading.Event()
+_KB_FILE_LOCK = threading.Lock()
+
+def schedule_kb_file_save():
+    """Помечает файл базы знаний для фоновой записи"""
+    _KB_DIRTY.set()
+
+def _flush_kb_to_disk():
+    """Записывает базу знаний в файл, если есть несохраненные изменения"""
+    # Запись целиком под блокировкой файла, чтобы более старый снимок
+    # не перезаписал более новый
+    with _KB_FILE_LOCK:
+        if not _KB_DIRTY.is_set():
+            return
+        _KB_DIRTY.clear()
+        with _KB_LOCK:
+            snapshot = dict(KNOWLEDGE_BASE)
+        try:
+            write_json_file(KNOWLEDGE_FILE, snapshot)
+            print("✅ База знаний сохранена в файл")
+        except Exception as e:
+            print(f"❌ Ошибка сохранения в файл: {e}")
+
+def _kb_flusher():
+    """Фоновый поток записи файла базы знаний"""
+    while True:
+        _KB_DIRTY.wait()
+        time.sleep(KB_FLUSH_DELAY)
+        _flush_kb_to_disk()
+
+threading.Thread(target=_kb_flusher, name="kb-flusher", daemon=True).start()
+atexit.register(_flush_kb_to_disk)
+
 def add_knowledge_item(question, answer, created_by="admin"):
     """Добавляет новый вопрос-ответ в базу знаний"""
+    global _KB_RELOAD_NEEDED
+    _KB_RELOAD_NEEDED = True
     # Пытаемся добавить в PostgreSQL
-    conn = get_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor()
-            cur.execute("""
-                INSERT INTO knowledge_base (question, answer, created_by) 
-                VALUES (%s, %s, %s)
-                ON CONFLICT (question) 
-                DO UPDATE SET 
-                    answer = EXCLUDED.answer,
-                    updated_at = CURRENT_TIMESTAMP
-            """, (question.strip().lower(), answer.strip(), created_by))
+    with pg_conn() as conn:
+        if conn:
+            try:
+                cur = conn.cursor()
+                kb_execute(cur, "kb_upsert", (question.strip().lower(), answer.strip(), created_by))
             
-            conn.commit()
-            cur.close()
-            conn.close()
-            print(f"✅ Вопрос добавлен в PostgreSQL: '{question}'")
-        except Exception as e:
-            print(f"❌ Ошибка добавления в PostgreSQL: {e}")
+                conn.commit()
+                cur.close()
+                print(f"✅ Вопрос добавлен в PostgreSQL: '{question}'")
+            except Exception as e:
+                print(f"❌ Ошибка добавления в PostgreSQL: {e}")
     
     # Добавляем в локальную переменную и сохраняем в файл
-    KNOWLEDGE_BASE[question.strip().lower()] = answer.strip()
+    with _KB_LOCK:
+        KNOWLEDGE_BASE[question.strip().lower()] = answer.strip()
+        _rebuild_kb_index()
     
-    # Сохраняем в файл (для резервной копии)
-    try:
-        with open(KNOWLEDGE_FILE, "w", encoding="utf-8") as f:
-            json.dump(KNOWLEDGE_BASE, f, ensure_ascii=False, indent=4)
-        print(f"✅ Вопрос сохранен в файл: '{question}'")
-    except Exception as e:
-        print(f"❌ Ошибка сохранения в файл: {e}")
+    # Сохраняем в файл (для резервной копии) — фоновой отложенной записью
+    schedule_kb_file_save()
     
     return True
 
+def add_knowledge_items_bulk(items, created_by="admin"):
+    """Добавляет пачку вопросов-ответов одной транзакцией.
+    Возвращает (сохранено, ошибок): при сбое PostgreSQL вся пачка считается ошибочной"""
+    global _KB_RELOAD_NEEDED
+    # Словарь убирает повторы: UPSERT не может дважды обновить одну строку за запрос
+    rows = {question.strip().lower(): answer.strip() for question, answer in items}
+    if not rows:
+        return 0, 0
+    _KB_RELOAD_NEEDED = True
+    failed = 0
+    with pg_conn() as conn:
+        if conn:
+            try:
+                cur = conn.cursor()
+                execute_values(cur, """
+                    INSERT INTO knowledge_base (question, answer, created_by) VALUES %s
+                    ON CONFLICT (question)
+                    DO UPDATE SET
+                        answer = EXCLUDED.answer,
+                        updated_at = CURRENT_TIMESTAMP
+                """, [(question, answer, created_by) for question, answer in rows.items()], page_size=500)
+                conn.commit()
+                cur.close()
+                print(f"✅ В PostgreSQL добавлено вопросов: {len(rows)}")
+            except Exception as e:
+                conn.rollback()
+                failed = len(rows)
+                print(f"❌ Ошибка пакетного добавления в PostgreSQL: {e}")
+
+    # Индекс перестраиваем один раз на всю пачку
+    with _KB_LOCK:
+        KNOWLEDGE_BASE.update(rows)
+        _rebuild_kb_index()
+
+    schedule_kb_file_save()
+    return len(rows) - failed, failed
+
 def update_knowledge_item(old_question, new_question, answer, created_by="admin"):
     """Обновляет вопрос-ответ в базе знаний"""
+    global _KB_RELOAD_NEEDED
+    _KB_RELOAD_NEEDED = True
     # Пытаемся обновить в PostgreSQL
-    conn = get_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor()
+    with pg_conn() as conn:
+        if conn:
+            try:
+                cur = conn.cursor()
             
-            if old_question != new_question:
-                # Если вопрос изменился, нужно удалить старую запись и создать новую
-                cur.execute("DELETE FROM knowledge_base WHERE question = %s", (old_question,))
+                if old_question != new_question:
+                    # Если вопрос изменился, нужно удалить старую запись и создать новую
+                    kb_execute(cur, "kb_delete", (old_question,))
             
-            cur.execute("""
-                INSERT INTO knowledge_base (question, answer, created_by) 
-                VALUES (%s, %s, %s)
-                ON CONFLICT (question) 
-                DO UPDATE SET 
-                    answer = EXCLUDED.answer,
-                    updated_at = CURRENT_TIMESTAMP
-            """, (new_question.strip().lower(), answer.strip(), created_by))
+                kb_execute(cur, "kb_upsert", (new_question.strip().lower(), answer.strip(), created_by))
             
-            conn.commit()
-            cur.close()
-            conn.close()
-            print(f"✅ Вопрос обновлен в PostgreSQL: '{old_question}' -> '{new_question}'")
-        except Exception as e:
-            print(f"❌ Ошибка обновления в PostgreSQL: {e}")
+                conn.commit()
+                cur.close()
+                print(f"✅ Вопрос обновлен в PostgreSQL: '{old_question}' -> '{new_question}'")
+            except Exception as e:
+                print(f"❌ Ошибка обновления в PostgreSQL: {e}")
     
     # Обновляем в локальной переменной
-    if old_question in KNOWLEDGE_BASE:
-        del KNOWLEDGE_BASE[old_question]
-    KNOWLEDGE_BASE[new_question.strip().lower()] = answer.strip()
+    with _KB_LOCK:
+        if old_question in KNOWLEDGE_BASE:
+            del KNOWLEDGE_BASE[old_question]
+        KNOWLEDGE_BASE[new_question.strip().lower()] = answer.strip()
+        _rebuild_kb_index()
     
     # Сохраняем в файл
-    try:
-        with open(KNOWLEDGE_FILE, "w", encoding="utf-8") as f:
-            json.dump(KNOWLEDGE_BASE, f, ensure_ascii=False, indent=4)
-        print(f"✅ Вопрос обновлен в файле: '{old_question}' -> '{new_question}'")
-    except Exception as e:
-        print(f"❌ Ошибка сохранения в файл: {e}")
+    schedule_kb_file_save()
     
     return True
 
 def delete_knowledge_item(question):
     """Удаляет вопрос из базы знаний"""
+    global _KB_RELOAD_NEEDED
+    _KB_RELOAD_NEEDED = True
     # Пытаемся удалить из PostgreSQL
-    conn = get_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor()
-            cur.execute("DELETE FROM knowledge_base WHERE question = %s", (question.strip().lower(),))
-            conn.commit()
-            cur.close()
-            conn.close()
-            print(f"✅ Вопрос удален из PostgreSQL: '{question}'")
-        except Exception as e:
-            print(f"❌ Ошибка удаления из PostgreSQL: {e}")
+    with pg_conn() as conn:
+        if conn:
+            try:
+                cur = conn.cursor()
+                kb_execute(cur, "kb_delete", (question.strip().lower(),))
+                conn.commit()
+                cur.close()
+                print(f"✅ Вопрос удален из PostgreSQL: '{question}'")
+            except Exception as e:
+                print(f"❌ Ошибка удаления из PostgreSQL: {e}")
     
     # Удаляем из локальной переменной и сохраняем в файл
-    if question in KNOWLEDGE_BASE:
+    with _KB_LOCK:
+        if question not in KNOWLEDGE_BASE:
+            return False
         del KNOWLEDGE_BASE[question]
+        _rebuild_kb_index()
         
-        # Сохраняем в файл
-        try:
-            with open(KNOWLEDGE_FILE, "w", encoding="utf-8") as f:
-                json.dump(KNOWLEDGE_BASE, f, ensure_ascii=False, indent=4)
-            print(f"✅ Вопрос удален из файла: '{question}'")
-            return True
-        except Exception as e:
-            print(f"❌ Ошибка сохранения в файл: {e}")
-            return False
-    
-    return False
+    # Сохраняем в файл
+    schedule_kb_file_save()
+    return True
+
+KB_SEARCH_LIMIT = 50  # больше результатов поиска админке не показываем
 
 def search_knowledge(query):
-    """Ищет вопросы в базе знаний"""
-    conn = get_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            cur.execute("""
-                SELECT question, answer 
-                FROM knowledge_base 
-                WHERE question ILIKE %s
-                ORDER BY question
-            """, (f'%{query}%',))
+    """Ищет вопросы в базе знаний (не больше KB_SEARCH_LIMIT)"""
+    with pg_conn() as conn:
+        if conn:
+            try:
+                cur = conn.cursor(cursor_factory=RealDictCursor)
+                results = []
+                # Полнотекстовый поиск по GIN-индексу (учитывает словоформы)
+                try:
+                    cur.execute("""
+                        SELECT question, answer
+                        FROM knowledge_base, websearch_to_tsquery('russian', %s) AS query
+                        WHERE question_tsv @@ query
+                        ORDER BY ts_rank(question_tsv, query) DESC, question
+                        LIMIT %s
+                    """, (query, KB_SEARCH_LIMIT))
+                    results = cur.fetchall()
+                except Exception as e:
+                    print(f"⚠️ Полнотекстовый поиск недоступен: {e}")
+                    conn.rollback()
             
-            results = cur.fetchall()
-            cur.close()
-            conn.close()
-            return results
-        except Exception as e:
-            print(f"❌ Ошибка поиска в PostgreSQL: {e}")
+                # Если по словам ничего не нашлось, ищем подстроку
+                if not results:
+                    cur.execute("""
+                        SELECT question, answer 
+                        FROM knowledge_base 
+                        WHERE question ILIKE %s
+                        ORDER BY question
+                        LIMIT %s
+                    """, (f'%{query}%', KB_SEARCH_LIMIT))
+                    results = cur.fetchall()
+                cur.close()
+                return results
+            except Exception as e:
+                print(f"❌ Ошибка поиска в PostgreSQL: {e}")
     
     # Если PostgreSQL недоступен, ищем в локальной базе
     results = []
     for question, answer in KNOWLEDGE_BASE.items():
         if query.lower() in question.lower():
             results.append({'question': question, 'answer': answer})
+            if len(results) >= KB_SEARCH_LIMIT:
+                break
     return results
 
 # - Декоратор для отключения кэширования -
@@ -374,8 +788,51 @@ def no_cache(view):
         return response
     return no_cache_view
 
+# - Декоратор для маршрутов админки -
+def admin_required(view=None, *, flash_denied=False, text=None, denied_json=None):
+    """Пускает только вошедшего администратора. Иначе отдает denied_json с кодом 403,
+    текст text или редирект на вход (с flash-сообщением при flash_denied)"""
+    def decorator(view):
+        @functools.wraps(view)
+        def admin_view(*args, **kwargs):
+            if not session.get("admin_logged_in"):
+                if denied_json is not None:
+                    return jsonify(denied_json), 403
+                if text is not None:
+                    return text
+                if flash_denied:
+                    flash("❌ Доступ запрещён", "error")
+                return redirect(url_for("admin_login"))
+            return view(*args, **kwargs)
+        return admin_view
+    # Поддерживаем и @admin_required, и @admin_required(...)
+    return decorator(view) if view is not None else decorator
+
+# - Быстрые JSON-ответы -
+def json_response(obj, status=200):
+    """JSON-ответ через orjson (компактный, без сортировки ключей)"""
+    if ORJSON_AVAILABLE:
+        return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+    response = jsonify(obj)
+    response.status_code = status
+    return response
+
+# - Условные ответы по ETag -
+def not_modified(etag):
+    """Ответ 304, если клиент прислал совпадающий If-None-Match, иначе None"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
 # - Вспомогательные функции -
 
+# Регулярные выражения для нормализации (компилируются один раз)
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_WS_RE = re.compile(r'\s+')
+
+@functools.lru_cache(maxsize=8192)
 def normalize_text(text):
     """Нормализует текст для поиска: приводит к нижнему регистру, удаляет знаки препинания"""
     if not text:
@@ -385,55 +842,98 @@ def normalize_text(text):
     text = text.lower()
     
     # Удаляем знаки препинания (сохраняем только буквы, цифры и пробелы)
-    text = re.sub(r'[^\w\s]', '', text)
+    text = _PUNCT_RE.sub('', text)
     
     # Заменяем множественные пробелы на один
-    text = re.sub(r'\s+', ' ', text)
+    text = _WS_RE.sub(' ', text)
     
     # Удаляем пробелы в начале и конце
     return text.strip()
 
+# - Нечеткий поиск по базе знаний: rapidfuzz (C++) или подсчет общих слов -
+try:
+    from rapidfuzz import process, fuzz
+    RAPIDFUZZ_AVAILABLE = True
+except ImportError:
+    RAPIDFUZZ_AVAILABLE = False
+
+# Минимальная схожесть (0-100) для нечеткого совпадения; при 60 короткие
+# русские вопросы ловят посторонние ответы ("где вы находитесь" -> кулер)
+KB_FUZZY_CUTOFF = 75
+
+def _rebuild_kb_index():
+    """Перестраивает индекс нормализованных ключей базы знаний"""
+    global _KB_NORM, _KB_INVERTED, _KB_KEYS_NORM, _KB_INDEX_VERSION
+    kb_norm = {}
+    inverted = {}
+    for key, value in KNOWLEDGE_BASE.items():
+        normalized_key = normalize_text(key)
+        # При совпадении нормализованных ключей побеждает первый, как при линейном поиске
+        if normalized_key in kb_norm:
+            continue
+        kb_norm[normalized_key] = (key, value, len(kb_norm))
+        for word in set(normalized_key.split()):
+            inverted.setdefault(word, []).append(normalized_key)
+    _KB_NORM = kb_norm
+    _KB_INVERTED = inverted
+    _KB_KEYS_NORM = list(kb_norm)
+    # Новый номер сборки: поиск, начатый по старому индексу, кладет результат
+    # под старый ключ, и после перестройки его уже никто не прочитает
+    _KB_INDEX_VERSION += 1
+    # Старые записи больше не нужны, освобождаем память
+    _find_in_knowledge_base.cache_clear()
+
 def find_in_knowledge_base(question):
     """Ищет наиболее релевантный ответ в базе знаний с учетом нормализации"""
+    return _find_in_knowledge_base(question, _KB_INDEX_VERSION)
+
+@functools.lru_cache(maxsize=2048)
+def _find_in_knowledge_base(question, index_version):
+    """Поиск по базе знаний; index_version отделяет результаты разных сборок индекса"""
     normalized_question = normalize_text(question)
-    
+
     # Сначала проверяем точное совпадение (оригинальный вопрос)
-    if question in KNOWLEDGE_BASE:
-        return KNOWLEDGE_BASE[question]
-    
+    answer = KNOWLEDGE_BASE.get(question)
+    if answer is not None:
+        return answer
+
     # Проверяем точное совпадение после нормализации
-    for key, value in KNOWLEDGE_BASE.items():
-        if normalize_text(key) == normalized_question:
-            return value
-    
+    entry = _KB_NORM.get(normalized_question)
+    if entry:
+        return entry[1]
+
     # Ищем частичное совпадение (если нормализованный вопрос содержит ключ)
-    for key, value in KNOWLEDGE_BASE.items():
-        normalized_key = normalize_text(key)
+    for normalized_key, (key, value, rank) in _KB_NORM.items():
         if normalized_key in normalized_question or normalized_question in normalized_key:
             return value
-    
+
     # Ищем совпадение по словам (если есть общие значимые слова)
     question_words = set(normalized_question.split())
-    if len(question_words) > 1:  # Только если в вопросе больше одного слова
-        best_match = None
-        best_score = 0
-        
-        for key, value in KNOWLEDGE_BASE.items():
-            normalized_key = normalize_text(key)
-            key_words = set(normalized_key.split())
-            
-            # Считаем количество совпадающих слов
-            common_words = question_words.intersection(key_words)
-            score = len(common_words)
-            
+    if len(question_words) > 1 and RAPIDFUZZ_AVAILABLE:  # Только если в вопросе больше одного слова
+        # Сравнение наборов слов целиком в C++; при равном счете
+        # побеждает вопрос, стоящий раньше в базе
+        match = process.extractOne(normalized_question, _KB_KEYS_NORM,
+                                   scorer=fuzz.token_set_ratio, score_cutoff=KB_FUZZY_CUTOFF)
+        if match and _KB_NORM[match[0]][1]:
+            return _KB_NORM[match[0]][1]
+    # Без rapidfuzz или если он ничего не нашел - подсчет общих слов
+    if len(question_words) > 1:
+        # Считаем количество совпадающих слов только для вопросов,
+        # у которых есть хотя бы одно общее слово (по обратному индексу)
+        scores = {}
+        for word in question_words:
+            for normalized_key in _KB_INVERTED.get(word, ()):
+                scores[normalized_key] = scores.get(normalized_key, 0) + 1
+
+        if scores:
+            # При равном счете побеждает вопрос, стоящий раньше в базе
+            best_key = max(scores, key=lambda k: (scores[k], -_KB_NORM[k][2]))
+            best_match = _KB_NORM[best_key][1]
+
             # Учитываем длину вопроса чтобы избежать ложных срабатываний
-            if score > best_score and score >= max(1, len(question_words) * 0.5):
-                best_score = score
-                best_match = value
-        
-        if best_match:
-            return best_match
-    
+            if scores[best_key] >= max(1, len(question_words) * 0.5) and best_match:
+                return best_match
+
     return None
 
 def load_bookings():
@@ -441,8 +941,7 @@ def load_bookings():
     global BOOKINGS
     if os.path.exists(BOOKINGS_FILE):
         try:
-            with open(BOOKINGS_FILE, "r", encoding="utf-8") as f:
-                BOOKINGS = json.load(f)
+            BOOKINGS = read_json_file(BOOKINGS_FILE)
             print("✅ Бронирования загружены")
         except Exception as e:
             print(f"❌ Ошибка загрузки бронирований: {e}")
@@ -453,8 +952,7 @@ def load_bookings():
 def save_bookings():
     """Сохраняет бронирования в JSON"""
     try:
-        with open(BOOKINGS_FILE, "w", encoding="utf-8") as f:
-            json.dump(BOOKINGS, f, ensure_ascii=False, indent=4)
+        write_json_file(BOOKINGS_FILE, BOOKINGS)
         print("✅ Бронирования сохранены")
     except Exception as e:
         print(f"❌ Ошибка сохранения бронирований: {e}")
@@ -465,9 +963,9 @@ def load_suggestion_map():
     # Пытаемся загрузить из файла
     if os.path.exists(SUGGESTIONS_FILE):
         try:
-            with open(SUGGESTIONS_FILE, "r", encoding="utf-8") as f:
-                suggestionMap = json.load(f)
+            suggestionMap = read_json_file(SUGGESTIONS_FILE)
             print("✅ Подсказки загружены из файла")
+            _rebuild_suggestion_index()
             return  # Выходим после успешной загрузки
         except Exception as e:
             print(f"❌ Ошибка загрузки подсказок: {e}")
@@ -491,29 +989,74 @@ def load_suggestion_map():
             {"text": "Цены", "question": "цены", "answer": "Цены зависят от выбранного аттракциона. Уточните у нашего менеджера! 💵"}
         ]
     }
+    _rebuild_suggestion_index()
     # Сохраняем дефолтные подсказки только при первом создании
     try:
-        with open(SUGGESTIONS_FILE, "w", encoding="utf-8") as f:
-            json.dump(suggestionMap, f, ensure_ascii=False, indent=4)
+        write_json_file(SUGGESTIONS_FILE, suggestionMap)
         print("✅ Создан файл suggestions.json по умолчанию")
     except Exception as e:
         print(f"❌ Ошибка сохранения подсказок: {e}")
 
+def _rebuild_suggestion_index():
+    """Перестраивает индексы подсказок: по нормализованному вопросу (по темам и общий)
+    и позиции подсказок по тексту внутри темы"""
+    global _SUGG_BY_TOPIC_NORMQ, _SUGG_BY_NORMQ, _SUGG_POS_BY_TOPIC_TEXT
+    global _SUGG_TOPIC_PAYLOADS, _SUGG_DEFAULT_PAYLOAD, SUGGESTION_VIEW
+    index = {}
+    all_index = {}
+    positions = {}
+    for topic, suggestions in suggestionMap.items():
+        topic_index = index.setdefault(topic, {})
+        topic_positions = positions.setdefault(topic, {})
+        for i, suggestion in enumerate(suggestions):
+            normalized_question = normalize_text(suggestion.get("question"))
+            # При повторе вопроса (или текста) побеждает первая подсказка, как при линейном поиске
+            topic_index.setdefault(normalized_question, suggestion)
+            all_index.setdefault(normalized_question, suggestion)
+            topic_positions.setdefault(suggestion.get("text"), i)
+    _SUGG_BY_TOPIC_NORMQ = index
+    _SUGG_BY_NORMQ = all_index
+    _SUGG_POS_BY_TOPIC_TEXT = positions
+    # Ответы /suggestions/<topic> сериализуем один раз; пустые темы отдают default
+    _SUGG_TOPIC_PAYLOADS = {topic: _suggestions_payload(suggestions)
+                            for topic, suggestions in suggestionMap.items() if suggestions}
+    _SUGG_DEFAULT_PAYLOAD = _suggestions_payload(suggestionMap.get("default", []))
+    # Плоское представление для шаблона: кортежи вместо обращений к словарям в Jinja
+    SUGGESTION_VIEW = [(topic, [(s.get("text", ""), s.get("question", ""), s.get("answer", ""))
+                                for s in suggestions])
+                       for topic, suggestions in suggestionMap.items()]
+
+def _suggestions_payload(suggestions):
+    """Готовое тело ответа со списком подсказок и его ETag"""
+    body = app.json.dumps({"suggestions": suggestions}, separators=(",", ":")).encode("utf-8")
+    return body, hashlib.blake2b(body, digest_size=8).hexdigest()
+
+def find_suggestion_position(topic, text):
+    """Позиция подсказки с текстом text в списке темы topic, или None"""
+    return _SUGG_POS_BY_TOPIC_TEXT.get(topic, {}).get(text)
+
 def save_suggestion_map():
     """Сохраняет контекстные подсказки в JSON"""
+    _rebuild_suggestion_index()
     try:
-        with open(SUGGESTIONS_FILE, "w", encoding="utf-8") as f:
-            json.dump(suggestionMap, f, ensure_ascii=False, indent=4)
+        write_json_file(SUGGESTIONS_FILE, suggestionMap)
         print("✅ Подсказки сохранены")
     except Exception as e:
         print(f"❌ Ошибка сохранения подсказок: {e}")
 
 def load_menu_categories():
+    """Возвращает категории меню из кэша процесса (файл читается при первом обращении)"""
+    global MENU_CATEGORIES_CACHE
+    if MENU_CATEGORIES_CACHE is None:
+        MENU_CATEGORIES_CACHE = _read_menu_categories()
+    # Отдаем копию: маршруты правят полученный словарь перед сохранением
+    return {group: dict(items) for group, items in MENU_CATEGORIES_CACHE.items()}
+
+def _read_menu_categories():
     """Загружает категории меню из JSON файла."""
     if os.path.exists(MENU_CATEGORIES_FILE):
         try:
-            with open(MENU_CATEGORIES_FILE, 'r', encoding='utf-8') as f:
-                categories = json.load(f)
+            categories = read_json_file(MENU_CATEGORIES_FILE)
             # Преобразуем в структуру, ожидаемую шаблоном
             return {
                 "system_categories": {
@@ -558,9 +1101,11 @@ def save_menu_categories(categories_dict):
             flat_categories.update(categories_dict["system_categories"])
         if "custom_categories" in categories_dict:
             flat_categories.update(categories_dict["custom_categories"])
-        with open(MENU_CATEGORIES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(flat_categories, f, ensure_ascii=False, indent=2)
+        write_json_file(MENU_CATEGORIES_FILE, flat_categories)
         print("✅ Категории меню сохранены")
+        # Кэш перечитается из файла при следующем обращении
+        global MENU_CATEGORIES_CACHE
+        MENU_CATEGORIES_CACHE = None
     except Exception as e:
         print(f"❌ Ошибка сохранения категорий меню: {e}")
 
@@ -573,10 +1118,10 @@ def load_menu():
     menu_items = []
     if os.path.exists(MENU_FILE):
         try:
-            with open(MENU_FILE, "r", encoding="utf-8") as f:
-                menu_items = json.load(f)
+            menu_items = read_json_file(MENU_FILE)
             print("✅ Меню загружено")
             MENU_CACHE = menu_items
+            _rebuild_menu_index(menu_items)
         except Exception as e:
             print(f"❌ Ошибка загрузки меню: {e}")
     else:
@@ -588,25 +1133,52 @@ def load_menu():
             {"admin_text": "Выпускные", "display_text": "🎓 Выпускные", "question": "выпускные", "category": "events", "price_info": "", "suggestion_topic": "default"},
             {"admin_text": "Мероприятия", "display_text": "🎪 Мероприятия", "question": "мероприятия", "category": "events", "price_info": "", "suggestion_topic": "default"}
         ]
-        with open(MENU_FILE, "w", encoding="utf-8") as f:
-            json.dump(menu_items, f, ensure_ascii=False, indent=4)
+        write_json_file(MENU_FILE, menu_items)
         print("✅ Создан файл menu.json по умолчанию")
         MENU_CACHE = menu_items
+        _rebuild_menu_index(menu_items)
     return menu_items
 
+def get_menu():
+    """Возвращает меню из кэша процесса (загружается при старте и после сброса кэша)"""
+    if MENU_CACHE is not None:
+        return MENU_CACHE
+    return load_menu()
+
+def _rebuild_menu_index(menu_items):
+    """Перестраивает индексы меню: по вопросу, категории и тексту для админки"""
+    global _MENU_BY_NORMQ, _MENU_BY_CATEGORY, _MENU_BY_ADMIN_TEXT, _MENU_BY_QUESTION
+    index = {}
+    by_category = {}
+    by_admin_text = {}
+    by_question = {}
+    for i, item in enumerate(menu_items):
+        # При повторе вопроса побеждает первая кнопка, как при линейном поиске
+        index.setdefault(normalize_text(item.get("question")), item)
+        by_category.setdefault(item.get("category"), []).append(item)
+        by_admin_text.setdefault(item.get("admin_text"), []).append(i)
+        by_question.setdefault(item.get("question"), []).append(i)
+    _MENU_BY_NORMQ = index
+    _MENU_BY_CATEGORY = by_category
+    _MENU_BY_ADMIN_TEXT = by_admin_text
+    _MENU_BY_QUESTION = by_question
+
 def save_menu(menu_items):
     """Сохраняет меню в JSON"""
     try:
-        with open(MENU_FILE, "w", encoding="utf-8") as f:
-            json.dump(menu_items, f, ensure_ascii=False, indent=4)
+        write_json_file(MENU_FILE, menu_items)
         print("✅ Меню сохранено")
         # 🔥 Принудительно обновляем глобальную переменную
         global MENU_CACHE
         MENU_CACHE = menu_items
+        _rebuild_menu_index(menu_items)
     except Exception as e:
         print(f"❌ Ошибка сохранения меню: {e}")
 
 # - Загрузка данных при старте -
+init_db_pool()
+migrate_json_to_jsonl(LEGACY_LOG_FILE, LOG_FILE)
+migrate_json_to_jsonl(LEGACY_FEEDBACK_FILE, FEEDBACK_FILE)
 load_knowledge_base()
 load_bookings()
 load_suggestion_map()
@@ -663,15 +1235,15 @@ def force_sync_now():
         postgres_data = {row['question']: row['answer'] for row in rows}
         
         # Сохраняем в файл
-        with open(KNOWLEDGE_FILE, "w", encoding="utf-8") as f:
-            json.dump(postgres_data, f, ensure_ascii=False, indent=4)
+        write_json_file(KNOWLEDGE_FILE, postgres_data)
         
         # Обновляем глобальную переменную
         global KNOWLEDGE_BASE
-        KNOWLEDGE_BASE = postgres_data
+        with _KB_LOCK:
+            KNOWLEDGE_BASE = postgres_data
+            _rebuild_kb_index()
         
         cur.close()
-        conn.close()
         
         return f"""
         ✅ СИНХРОНИЗАЦИЯ ВЫПОЛНЕНА!
@@ -686,39 +1258,39 @@ def force_sync_now():
         
     except Exception as e:
         return f"❌ Ошибка синхронизации: {str(e)}"
+    finally:
+        release_db_connection(conn)
     
 
 @app.route("/admin/sync-knowledge")
+@admin_required(text="❌ Требуется авторизация")
 def admin_sync_knowledge():
     """Полная синхронизация базы знаний между PostgreSQL и файлом"""
-    if not session.get("admin_logged_in"):
-        return "❌ Требуется авторизация"
-    
     sync_results = []
     
     # 1. Синхронизация из PostgreSQL в файл
-    conn = get_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            cur.execute("SELECT question, answer FROM knowledge_base")
-            rows = cur.fetchall()
-            postgres_data = {row['question']: row['answer'] for row in rows}
+    with pg_conn() as conn:
+        if conn:
+            try:
+                cur = conn.cursor(cursor_factory=RealDictCursor)
+                cur.execute("SELECT question, answer FROM knowledge_base")
+                rows = cur.fetchall()
+                postgres_data = {row['question']: row['answer'] for row in rows}
             
-            # Сохраняем в файл
-            with open(KNOWLEDGE_FILE, "w", encoding="utf-8") as f:
-                json.dump(postgres_data, f, ensure_ascii=False, indent=4)
+                # Сохраняем в файл
+                write_json_file(KNOWLEDGE_FILE, postgres_data)
             
-            sync_results.append(f"✅ PostgreSQL → файл: {len(postgres_data)} записей")
-            cur.close()
-            conn.close()
+                sync_results.append(f"✅ PostgreSQL → файл: {len(postgres_data)} записей")
+                cur.close()
             
-        except Exception as e:
-            sync_results.append(f"❌ Ошибка синхронизации PostgreSQL → файл: {e}")
+            except Exception as e:
+                sync_results.append(f"❌ Ошибка синхронизации PostgreSQL → файл: {e}")
     
     # 2. Обновляем глобальную переменную
     global KNOWLEDGE_BASE
-    KNOWLEDGE_BASE = postgres_data
+    with _KB_LOCK:
+        KNOWLEDGE_BASE = postgres_data
+        _rebuild_kb_index()
     
     # 3. Проверяем результат
     file_count = len(postgres_data)
@@ -776,21 +1348,20 @@ def debug_render_environment():
     # Пробуем подключиться к PostgreSQL
     connection_test = {"status": "Не выполнено"}
     try:
-        conn = get_db_connection()
-        if conn:
-            cur = conn.cursor()
-            cur.execute("SELECT version(), current_database(), current_user")
-            db_info = cur.fetchone()
-            cur.close()
-            conn.close()
-            connection_test = {
-                "status": "✅ Успешно",
-                "postgres_version": db_info[0],
-                "database": db_info[1],
-                "user": db_info[2]
-            }
-        else:
-            connection_test = {"status": "❌ get_db_connection() вернул None"}
+        with pg_conn() as conn:
+            if conn:
+                cur = conn.cursor()
+                cur.execute("SELECT version(), current_database(), current_user")
+                db_info = cur.fetchone()
+                cur.close()
+                connection_test = {
+                    "status": "✅ Успешно",
+                    "postgres_version": db_info[0],
+                    "database": db_info[1],
+                    "user": db_info[2]
+                }
+            else:
+                connection_test = {"status": "❌ get_db_connection() вернул None"}
     except Exception as e:
         connection_test = {
             "status": "❌ Ошибка подключения",
@@ -807,43 +1378,41 @@ def debug_render_environment():
 
 
 @app.route("/force-reload-knowledge")
+@admin_required(text="❌ Требуется авторизация")
 def force_reload_knowledge():
     """Принудительная перезагрузка базы знаний"""
-    if not session.get("admin_logged_in"):
-        return "❌ Требуется авторизация"
-    
     print("🔄 Принудительная перезагрузка базы знаний...")
     
     # Пытаемся загрузить из PostgreSQL
-    conn = get_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            cur.execute("SELECT question, answer FROM knowledge_base ORDER BY question")
-            rows = cur.fetchall()
-            postgres_data = {row['question']: row['answer'] for row in rows}
+    with pg_conn() as conn:
+        if conn:
+            try:
+                cur = conn.cursor(cursor_factory=RealDictCursor)
+                kb_execute(cur, "kb_select_all")
+                rows = cur.fetchall()
+                postgres_data = {row['question']: row['answer'] for row in rows}
             
-            # Обновляем глобальную переменную
-            global KNOWLEDGE_BASE
-            KNOWLEDGE_BASE = postgres_data
+                # Обновляем глобальную переменную
+                global KNOWLEDGE_BASE
+                with _KB_LOCK:
+                    KNOWLEDGE_BASE = postgres_data
+                    _rebuild_kb_index()
             
-            # Сохраняем в файл для резервной копии
-            with open(KNOWLEDGE_FILE, "w", encoding="utf-8") as f:
-                json.dump(KNOWLEDGE_BASE, f, ensure_ascii=False, indent=4)
+                # Сохраняем в файл для резервной копии
+                write_json_file(KNOWLEDGE_FILE, KNOWLEDGE_BASE)
             
-            cur.close()
-            conn.close()
+                cur.close()
             
-            return f"""
-            ✅ База знаний перезагружена из PostgreSQL!
-            Записей загружено: {len(KNOWLEDGE_BASE)}
-            Первые 3 записи: {dict(list(KNOWLEDGE_BASE.items())[:3])}
-            """
+                return f"""
+                ✅ База знаний перезагружена из PostgreSQL!
+                Записей загружено: {len(KNOWLEDGE_BASE)}
+                Первые 3 записи: {dict(list(KNOWLEDGE_BASE.items())[:3])}
+                """
             
-        except Exception as e:
-            return f"❌ Ошибка загрузки из PostgreSQL: {str(e)}"
-    else:
-        return "❌ Не удалось подключиться к PostgreSQL"
+            except Exception as e:
+                return f"❌ Ошибка загрузки из PostgreSQL: {str(e)}"
+        else:
+            return "❌ Не удалось подключиться к PostgreSQL"
     
 
 @app.route("/debug-packages")
@@ -873,11 +1442,9 @@ def debug_packages():
 
 
 @app.route("/quick-add-test")
+@admin_required(text="❌ Требуется авторизация")
 def quick_add_test():
     """Быстрое добавление тестовой записи через систему"""
-    if not session.get("admin_logged_in"):
-        return "❌ Требуется авторизация"
-    
     test_question = f"тест_вопрос_{int(time.time())}"
     test_answer = f"Тестовый ответ {datetime.now().strftime('%H:%M:%S')}"
     
@@ -895,24 +1462,22 @@ def check_sync():
     """Проверка синхронизации между PostgreSQL и файлом"""
     # Данные из PostgreSQL
     postgres_data = {}
-    conn = get_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            cur.execute("SELECT question, answer FROM knowledge_base")
-            rows = cur.fetchall()
-            postgres_data = {row['question']: row['answer'] for row in rows}
-            cur.close()
-            conn.close()
-        except Exception as e:
-            postgres_data = {"error": str(e)}
+    with pg_conn() as conn:
+        if conn:
+            try:
+                cur = conn.cursor(cursor_factory=RealDictCursor)
+                cur.execute("SELECT question, answer FROM knowledge_base")
+                rows = cur.fetchall()
+                postgres_data = {row['question']: row['answer'] for row in rows}
+                cur.close()
+            except Exception as e:
+                postgres_data = {"error": str(e)}
     
     # Данные из файла
     file_data = {}
     if os.path.exists(KNOWLEDGE_FILE):
         try:
-            with open(KNOWLEDGE_FILE, "r", encoding="utf-8") as f:
-                file_data = json.load(f)
+            file_data = read_json_file(KNOWLEDGE_FILE)
         except Exception as e:
             file_data = {"error": str(e)}
     
@@ -945,24 +1510,22 @@ def current_knowledge_status():
     
     # Получаем данные из PostgreSQL
     postgres_data = {}
-    conn = get_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            cur.execute("SELECT question, answer FROM knowledge_base")
-            rows = cur.fetchall()
-            postgres_data = {row['question']: row['answer'] for row in rows}
-            cur.close()
-            conn.close()
-        except Exception as e:
-            postgres_data = {"error": str(e)}
+    with pg_conn() as conn:
+        if conn:
+            try:
+                cur = conn.cursor(cursor_factory=RealDictCursor)
+                cur.execute("SELECT question, answer FROM knowledge_base")
+                rows = cur.fetchall()
+                postgres_data = {row['question']: row['answer'] for row in rows}
+                cur.close()
+            except Exception as e:
+                postgres_data = {"error": str(e)}
     
     # Получаем данные из файла
     file_data = {}
     if os.path.exists(KNOWLEDGE_FILE):
         try:
-            with open(KNOWLEDGE_FILE, "r", encoding="utf-8") as f:
-                file_data = json.load(f)
+            file_data = read_json_file(KNOWLEDGE_FILE)
         except Exception as e:
             file_data = {"error": str(e)}
     
@@ -985,20 +1548,19 @@ def debug_database():
     # Пытаемся подключиться к PostgreSQL
     postgres_status = "unknown"
     postgres_count = 0
-    conn = get_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor()
-            cur.execute("SELECT COUNT(*) as count FROM knowledge_base")
-            result = cur.fetchone()
-            postgres_count = result[0] if result else 0
-            postgres_status = "connected"
-            cur.close()
-            conn.close()
-        except Exception as e:
-            postgres_status = f"error: {e}"
-    else:
-        postgres_status = "not_connected"
+    with pg_conn() as conn:
+        if conn:
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT COUNT(*) as count FROM knowledge_base")
+                result = cur.fetchone()
+                postgres_count = result[0] if result else 0
+                postgres_status = "connected"
+                cur.close()
+            except Exception as e:
+                postgres_status = f"error: {e}"
+        else:
+            postgres_status = "not_connected"
     
     # Считаем записи в файле
     file_count = len(KNOWLEDGE_BASE) if KNOWLEDGE_BASE else 0
@@ -1014,12 +1576,13 @@ def debug_database():
         "current_mode": "PostgreSQL" if postgres_status == "connected" else "File"
     }
     
-    return jsonify(debug_info)
+    return json_response(debug_info)
 
 @app.route("/clear-menu-cache")
 def clear_menu_cache():
-    global MENU_CACHE
+    global MENU_CACHE, MENU_CATEGORIES_CACHE
     MENU_CACHE = None
+    MENU_CATEGORIES_CACHE = None
     load_menu()
     return "✅ Кэш меню очищен!"
 
@@ -1031,7 +1594,7 @@ def voice_ask():
         question = data.get("question", "").strip().lower()
         
         if not question:
-            return jsonify({"answer": "Голосовое сообщение не распознано. Попробуйте еще раз."})
+            return json_response({"answer": "Голосовое сообщение не распознано. Попробуйте еще раз."})
         
         # Логируем голосовой запрос
         logging.info(f"🎤 Голосовой запрос: {question}")
@@ -1049,11 +1612,11 @@ def voice_ask():
                 source = "error"
         
         log_interaction(f"[VOICE] {question}", response, source)
-        return jsonify({"answer": response})
+        return json_response({"answer": response})
         
     except Exception as e:
         print(f"❌ Ошибка обработки голосового запроса: {e}")
-        return jsonify({"answer": "❌ Произошла ошибка при обработке голосового запроса"})
+        return json_response({"answer": "❌ Произошла ошибка при обработке голосового запроса"})
 
 @app.route("/")
 def index():
@@ -1070,18 +1633,17 @@ def chat():
         print(f"\n🔍 ===== НОВЫЙ ЗАПРОС: '{question}' =====")
 
         if not question:
-            return jsonify({"response": "Пожалуйста, задайте вопрос.", "source": "error", "suggestions": []})
+            return json_response({"response": "Пожалуйста, задайте вопрос.", "source": "error", "suggestions": []})
 
         # 🔥 УПРОЩЕННАЯ ЛОГИКА - ШАГ 1: Ищем тему в меню
-        menu_items = load_menu()
+        normalized_question = normalize_text(question)
         menu_topic = None
         
-        for item in menu_items:
-            # Используем нормализацию для поиска в меню
-            if normalize_text(item["question"]) == normalize_text(question):
-                menu_topic = item.get("suggestion_topic")
-                print(f"✅ Найдена тема в меню: '{menu_topic}'")
-                break
+        # Используем нормализацию для поиска в меню (индекс по нормализованному вопросу)
+        menu_item = _MENU_BY_NORMQ.get(normalized_question)
+        if menu_item:
+            menu_topic = menu_item.get("suggestion_topic")
+            print(f"✅ Найдена тема в меню: '{menu_topic}'")
         
         # 🔥 ШАГ 2: Если тема не найдена, используем дефолтные подсказки
         if not menu_topic:
@@ -1089,17 +1651,25 @@ def chat():
             suggestions = [{"text": s["text"], "question": s["question"]} for s in suggestionMap.get("default", [])]
             
             # 🔥 ИСПОЛЬЗУЕМ ИНТЕЛЛЕКТУАЛЬНЫЙ ПОИСК В БАЗЕ ЗНАНИЙ
-            response = find_in_knowledge_base(question) or call_yandex_gpt(question)
-            source = "knowledge_base" if find_in_knowledge_base(question) else "yandex_gpt"
+            response = find_in_knowledge_base(question)
+            source = "knowledge_base"
+            if not response:
+                response = call_yandex_gpt(question)
+                source = "yandex_gpt"
             
             # ✅ ДОБАВЛЕНО: Записываем в лог
             log_interaction(question, response, source)
             
-            return jsonify({
+            payload = {
                 "response": response,
                 "source": source,
                 "suggestions": suggestions
-            })
+            }
+            # Браузер сразу озвучит ответ: синтезируем его, пока отдаем текст
+            if data.get("speak"):
+                payload["tts_text"] = tts_text_for_answer(response)
+                prefetch_tts(payload["tts_text"])
+            return json_response(payload)
         
         # 🔥 ШАГ 3: Получаем подсказки для темы
         topic_suggestions = suggestionMap.get(menu_topic, [])
@@ -1110,11 +1680,10 @@ def chat():
         response = None
         source = "suggestion_map"
         
-        for suggestion in topic_suggestions:
-            if normalize_text(suggestion["question"]) == normalize_text(question):
-                response = suggestion["answer"]
-                print(f"✅ Ответ найден в подсказках")
-                break
+        suggestion = _SUGG_BY_TOPIC_NORMQ.get(menu_topic, {}).get(normalized_question)
+        if suggestion:
+            response = suggestion["answer"]
+            print(f"✅ Ответ найден в подсказках")
         
         # 🔥 ШАГ 5: Если не нашли в подсказках, используем интеллектуальный поиск в базе знаний
         if not response:
@@ -1134,22 +1703,26 @@ def chat():
         # ✅ ДОБАВЛЕНО: Записываем в лог перед возвратом ответа
         log_interaction(question, response, source)
         
-        return jsonify({
+        payload = {
             "response": response,
             "source": source,
             "suggestions": suggestions
-        })
+        }
+        if data.get("speak"):
+            payload["tts_text"] = tts_text_for_answer(response)
+            prefetch_tts(payload["tts_text"])
+        return json_response(payload)
         
     except Exception as e:
         print(f"❌ Ошибка: {e}")
         # ✅ ДОБАВЛЕНО: Логируем ошибку
         log_interaction(question, f"❌ Произошла ошибка: {str(e)}", "error")
-        return jsonify({"response": "❌ Произошла ошибка", "source": "error", "suggestions": []})
+        return json_response({"response": "❌ Произошла ошибка", "source": "error", "suggestions": []})
 
 @app.route("/debug-suggestions")
 def debug_suggestions():
     """Диагностический маршрут для проверки подсказок"""
-    menu_items = load_menu()
+    menu_items = get_menu()
     debug_info = {
         "menu_items": menu_items,
         "suggestion_topics": list(suggestionMap.keys()),
@@ -1166,7 +1739,7 @@ def debug_suggestions():
     debug_info["platnie_uslugi"] = platnie_uslugi_item
     debug_info["platnie_uslugi_suggestions"] = suggestionMap.get("maniuslugi", [])
     
-    return jsonify(debug_info)
+    return json_response(debug_info)
 
 @app.route("/ask", methods=["POST"])
 def ask():
@@ -1174,7 +1747,7 @@ def ask():
     data = request.json
     question = data.get("question", "").strip()
     if not question:
-        return jsonify({"answer": "Пожалуйста, задайте вопрос."})
+        return json_response({"answer": "Пожалуйста, задайте вопрос."})
     
     # Используем интеллектуальный поиск
     response = find_in_knowledge_base(question)
@@ -1189,7 +1762,7 @@ def ask():
             source = "error"
     
     log_interaction(question, response, source)
-    return jsonify({"answer": response})
+    return json_response({"answer": response})
 
 @app.route("/feedback", methods=["POST"])
 def feedback():
@@ -1197,24 +1770,13 @@ def feedback():
     data = request.json
     question = data.get("question")
     feedback = data.get("feedback")
-    feedback_file = "feedback.json"
-    logs = []
-    if os.path.exists(feedback_file):
-        try:
-            with open(feedback_file, "r", encoding="utf-8") as f:
-                content = f.read().strip()
-                if content:
-                    logs = json.loads(content)
-        except:
-            pass
-    logs.append({
-        "timestamp": datetime.now().isoformat(),
-        "question": question,
-        "feedback": feedback
-    })
     try:
-        with open(feedback_file, "w", encoding="utf-8") as f:
-            json.dump(logs, f, ensure_ascii=False, indent=4)
+        # Оценок мало: пишем на диск сразу, чтобы не потерять буфер при SIGKILL воркера
+        append_jsonl(FEEDBACK_FILE, {
+            "timestamp": datetime.now().isoformat(),
+            "question": question,
+            "feedback": feedback
+        }, flush=True)
         return jsonify({"status": "ok"})
     except Exception as e:
         print(f"❌ Ошибка сохранения оценки: {e}")
@@ -1224,12 +1786,15 @@ def feedback():
 def get_suggestions_by_topic(topic):
     """Возвращает подсказки для указанной темы"""
     try:
-        # Ищем подсказки для указанной темы
-        suggestions = suggestionMap.get(topic.lower(), [])
-        # Если для темы нет подсказок, используем дефолтные
-        if not suggestions:
-            suggestions = suggestionMap.get("default", [])
-        return jsonify({"suggestions": suggestions})
+        # Готовый JSON подсказок темы; если для темы нет подсказок, используем дефолтные
+        body, etag = _SUGG_TOPIC_PAYLOADS.get(topic.lower(), _SUGG_DEFAULT_PAYLOAD)
+        response = not_modified(etag)
+        if response is None:
+            response = Response(body, mimetype="application/json")
+            response.set_etag(etag)
+        # Браузер хранит ответ, но сверяет ETag при каждом запросе
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         print(f"❌ Ошибка получения подсказок для темы {topic}: {e}")
         return jsonify({"suggestions": []})
@@ -1237,7 +1802,7 @@ def get_suggestions_by_topic(topic):
 @app.route("/api/menu-display")
 def get_menu_display():
     """API для получения меню с отображаемым текстом"""
-    menu_items = load_menu()
+    menu_items = get_menu()
     display_items = []
     for item in menu_items:
         display_items.append({
@@ -1248,17 +1813,15 @@ def get_menu_display():
     return jsonify(display_items)
 
 @app.route("/admin/suggestions")
+@admin_required
 def admin_suggestions():
     """Редактирование контекстных подсказки"""
-    if not session.get("admin_logged_in"):
-        return redirect(url_for("admin_login"))
-    return render_template("admin/suggestions.html", suggestion_map=suggestionMap)
+    return render_template("admin/suggestions.html", suggestion_view=SUGGESTION_VIEW)
 
 @app.route("/admin/suggestions", methods=["POST"])
+@admin_required
 def add_suggestion():
     """Добавление новой подсказки с ответом"""
-    if not session.get("admin_logged_in"):
-        return redirect(url_for("admin_login"))
     topic = request.form.get("topic").strip().lower()
     text = request.form.get("suggestion-text").strip()
     question = request.form.get("suggestion-question").strip().lower()
@@ -1268,7 +1831,7 @@ def add_suggestion():
         return redirect(url_for("admin_suggestions"))
     if topic not in suggestionMap:
         suggestionMap[topic] = []
-    if any(s["text"] == text for s in suggestionMap[topic]):
+    if find_suggestion_position(topic, text) is not None:
         flash("❌ Подсказка с таким названием уже существует", "error")
         return redirect(url_for("admin_suggestions"))
     # Добавляем answer в подсказку
@@ -1289,53 +1852,47 @@ def get_suggestion_answer():
     if not question:
         return jsonify({"answer": "❌ Вопрос не указан"}), 400
 
-    normalized_question = normalize_text(question)
-    
-    # Ищем ответ в suggestionMap с нормализацией
-    for topic, suggestions in suggestionMap.items():
-        for suggestion in suggestions:
-            suggestion_question = suggestion.get("question", "").strip()
-            if normalize_text(suggestion_question) == normalized_question:
-                return jsonify({"answer": suggestion.get("answer", "❌ Ответ не найден")})
+    # Ищем ответ в suggestionMap с нормализацией (по индексу)
+    suggestion = _SUGG_BY_NORMQ.get(normalize_text(question))
+    if suggestion:
+        return jsonify({"answer": suggestion.get("answer", "❌ Ответ не найден")})
 
     return jsonify({"answer": "❌ Ответ не найден"}), 404
 
 @app.route("/admin/suggestions/delete/<topic>/<text>")
+@admin_required
 def delete_suggestion(topic, text):
     """Удаление подсказки"""
-    if not session.get("admin_logged_in"):
-        return redirect(url_for("admin_login"))
     # Декодируем текст из URL
     text = unquote(text)
     if topic in suggestionMap:
-        suggestionMap[topic] = [s for s in suggestionMap[topic] if s["text"] != text]
-        save_suggestion_map()
+        # Удаляем на месте по индексу позиций, без пересборки списка темы
+        i = find_suggestion_position(topic, text)
+        if i is not None:
+            suggestionMap[topic].pop(i)
+            save_suggestion_map()
         flash("✅ Подсказка удалена", "success")
     else:
         flash("❌ Ошибка удаления", "error")
     return redirect(url_for("admin_suggestions"))
 
 @app.route("/admin/suggestions/edit/<topic>/<text>", methods=["GET", "POST"])
+@admin_required(flash_denied=True)
 def edit_suggestion(topic, text):
     """Редактирование подсказки"""
-    if not session.get("admin_logged_in"):
-        flash("❌ Доступ запрещён", "error")
-        return redirect(url_for("admin_login"))
     # Декодируем текст из URL
     text = unquote(text)
     if request.method == "GET":
         # Находим подсказку для редактирования
         suggestion_to_edit = None
-        if topic in suggestionMap:
-            for suggestion in suggestionMap[topic]:
-                if suggestion["text"] == text:
-                    suggestion_to_edit = suggestion
-                    break
+        i = find_suggestion_position(topic, text)
+        if i is not None:
+            suggestion_to_edit = suggestionMap[topic][i]
         if not suggestion_to_edit:
             flash("❌ Подсказка не найдена", "error")
             return redirect(url_for("admin_suggestions"))
         return render_template("admin/suggestions.html", 
-                             suggestion_map=suggestionMap,
+                             suggestion_view=SUGGESTION_VIEW,
                              edit_suggestion=suggestion_to_edit,
                              edit_topic=topic)
     else:  # POST - сохранение изменений
@@ -1347,43 +1904,38 @@ def edit_suggestion(topic, text):
             flash("❌ Все поля обязательны", "error")
             return redirect(url_for("admin_suggestions"))
         # Находим и обновляем подсказку
-        updated = False
-        if topic in suggestionMap:
-            for i, suggestion in enumerate(suggestionMap[topic]):
-                if suggestion["text"] == text:
-                    # Если изменилась тема, перемещаем подсказку
-                    if new_topic != topic:
-                        # Удаляем из старой темы
-                        suggestionMap[topic].pop(i)
-                        # Добавляем в новую тему
-                        if new_topic not in suggestionMap:
-                            suggestionMap[new_topic] = []
-                        suggestionMap[new_topic].append({
-                            "text": new_text,
-                            "question": new_question,
-                            "answer": new_answer
-                        })
-                    else:
-                        # Обновляем в текущей теме
-                        suggestionMap[topic][i] = {
-                            "text": new_text,
-                            "question": new_question,
-                            "answer": new_answer
-                        }
-                    save_suggestion_map()
-                    flash("✅ Подсказка обновлена", "success")
-                    logging.info(f"Подсказка обновлена: {topic}/{text} -> {new_topic}/{new_text}")
-                    updated = True
-                    break
-        if not updated:
+        i = find_suggestion_position(topic, text)
+        if i is not None:
+            # Если изменилась тема, перемещаем подсказку
+            if new_topic != topic:
+                # Удаляем из старой темы
+                suggestionMap[topic].pop(i)
+                # Добавляем в новую тему
+                if new_topic not in suggestionMap:
+                    suggestionMap[new_topic] = []
+                suggestionMap[new_topic].append({
+                    "text": new_text,
+                    "question": new_question,
+                    "answer": new_answer
+                })
+            else:
+                # Обновляем в текущей теме
+                suggestionMap[topic][i] = {
+                    "text": new_text,
+                    "question": new_question,
+                    "answer": new_answer
+                }
+            save_suggestion_map()
+            flash("✅ Подсказка обновлена", "success")
+            logging.info(f"Подсказка обновлена: {topic}/{text} -> {new_topic}/{new_text}")
+        else:
             flash("❌ Подсказка не найдена", "error")
         return redirect(url_for("admin_suggestions"))
 
 @app.route("/admin/suggestions/update", methods=["POST"])
+@admin_required(denied_json={"success": False, "error": "Доступ запрещён"})
 def update_suggestion():
     """API для обновления подсказки"""
-    if not session.get("admin_logged_in"):
-        return jsonify({"success": False, "error": "Доступ запрещён"}), 403
     try:
         topic = request.form.get("topic")
         old_text = request.form.get("old_text")
@@ -1392,37 +1944,33 @@ def update_suggestion():
         new_answer = request.form.get("answer")
         if not all([topic, old_text, new_text, new_question, new_answer]):
             return jsonify({"success": False, "error": "Все поля обязательны"})
-        if topic in suggestionMap:
-            for i, suggestion in enumerate(suggestionMap[topic]):
-                if suggestion["text"] == old_text:
-                    suggestionMap[topic][i] = {
-                        "text": new_text,
-                        "question": new_question,
-                        "answer": new_answer
-                    }
-                    save_suggestion_map()
-                    return jsonify({"success": True})
+        i = find_suggestion_position(topic, old_text)
+        if i is not None:
+            suggestionMap[topic][i] = {
+                "text": new_text,
+                "question": new_question,
+                "answer": new_answer
+            }
+            save_suggestion_map()
+            return jsonify({"success": True})
         return jsonify({"success": False, "error": "Подсказка не найдена"})
     except Exception as e:
         return jsonify({"success": False, "error": f"Ошибка сервера: {str(e)}"})
 
 @app.route("/admin/menu")
+@admin_required(flash_denied=True)
 def admin_menu():
     """Страница редактирования меню"""
-    if not session.get("admin_logged_in"):
-        flash("❌ Доступ запрещён", "error")
-        return redirect(url_for("admin_login"))
-    menu_items = load_menu()
+    menu_items = get_menu()
     categories = load_menu_categories()
     return render_template("admin/menu_edit.html", 
                          menu_items=menu_items,
                          categories=categories)
 
 @app.route("/admin/menu/add", methods=["POST"])
+@admin_required(denied_json={"success": False, "error": "Доступ запрещён"})
 def add_menu_item():
     """Добавление новой кнопки в меню"""
-    if not session.get("admin_logged_in"):
-        return jsonify({"success": False, "error": "Доступ запрещён"}), 403
     try:
         admin_text = request.form.get("admin_text", "").strip()
         display_text = request.form.get("display_text", "").strip()
@@ -1432,11 +1980,11 @@ def add_menu_item():
         suggestion_topic = request.form.get("suggestion_topic", "default")
         if not admin_text or not display_text or not question:
             return jsonify({"success": False, "error": "Все поля обязательны"})
-        menu_items = load_menu()
+        menu_items = get_menu()
         # Проверка на дубликаты
-        if any(item.get("admin_text") == admin_text for item in menu_items):
+        if admin_text in _MENU_BY_ADMIN_TEXT:
             return jsonify({"success": False, "error": "Кнопка с таким текстом для админки уже существует"})
-        if any(item.get("question") == question for item in menu_items):
+        if question in _MENU_BY_QUESTION:
             return jsonify({"success": False, "error": "Кнопка с таким вопросом уже существует"})
         # Создаем новую кнопку
         new_item = {
@@ -1455,12 +2003,10 @@ def add_menu_item():
         return jsonify({"success": False, "error": f"Ошибка сервера: {str(e)}"})
 
 @app.route("/admin/menu/edit/<int:index>", methods=["GET"])
+@admin_required(flash_denied=True)
 def edit_menu_item_form(index):
     """Отображение формы редактирования кнопки меню"""
-    if not session.get("admin_logged_in"):
-        flash("❌ Доступ запрещён", "error")
-        return redirect(url_for("admin_login"))
-    menu_items = load_menu()
+    menu_items = get_menu()
     categories = load_menu_categories()
     if 0 <= index < len(menu_items):
         item_to_edit = menu_items[index]
@@ -1474,12 +2020,11 @@ def edit_menu_item_form(index):
         return redirect(url_for("admin_menu"))
 
 @app.route("/admin/menu/edit/<int:index>", methods=["POST"])
+@admin_required(denied_json={"success": False, "error": "Доступ запрещён"})
 def edit_menu_item(index):
     """Обработка данных из формы редактирования кнопки меню"""
-    if not session.get("admin_logged_in"):
-        return jsonify({"success": False, "error": "Доступ запрещён"}), 403
     try:
-        menu_items = load_menu()
+        menu_items = get_menu()
         if not (0 <= index < len(menu_items)):
             return jsonify({"success": False, "error": "Неверный индекс кнопки"})
         admin_text = request.form.get("admin_text", "").strip()
@@ -1491,12 +2036,10 @@ def edit_menu_item(index):
         if not admin_text or not display_text or not question:
             return jsonify({"success": False, "error": "Все поля обязательны"})
         # Проверка на дубликаты (кроме самого редактируемого элемента)
-        for i, item in enumerate(menu_items):
-            if i != index:
-                if item.get("admin_text") == admin_text:
-                    return jsonify({"success": False, "error": "Кнопка с таким текстом для админки уже существует"})
-                if item.get("question") == question:
-                    return jsonify({"success": False, "error": "Кнопка с таким вопросом уже существует"})
+        if any(i != index for i in _MENU_BY_ADMIN_TEXT.get(admin_text, ())):
+            return jsonify({"success": False, "error": "Кнопка с таким текстом для админки уже существует"})
+        if any(i != index for i in _MENU_BY_QUESTION.get(question, ())):
+            return jsonify({"success": False, "error": "Кнопка с таким вопросом уже существует"})
         # Обновляем элемент
         menu_items[index] = {
             "admin_text": admin_text,
@@ -1513,13 +2056,11 @@ def edit_menu_item(index):
         return jsonify({"success": False, "error": f"Ошибка сервера: {str(e)}"})
 
 @app.route("/admin/menu/delete/<int:index>")
+@admin_required(flash_denied=True)
 def delete_menu_item(index):
     """Удаление кнопки из меню"""
-    if not session.get("admin_logged_in"):
-        flash("❌ Доступ запрещён", "error")
-        return redirect(url_for("admin_login"))
     try:
-        menu_items = load_menu()
+        menu_items = get_menu()
         if 0 <= index < len(menu_items):
             removed = menu_items.pop(index)
             save_menu(menu_items)
@@ -1535,48 +2076,42 @@ def delete_menu_item(index):
 @no_cache
 def get_menu_items():
     """Возвращает меню для фронтенда"""
-    menu_items = load_menu()
+    menu_items = get_menu()
     return jsonify({"items": menu_items})
 
 @app.route('/menu-items/<category>')
 @no_cache
 def get_menu_items_by_category(category):
     """Возвращает меню отфильтрованное по категории"""
-    menu_items = load_menu()
-    filtered_items = [item for item in menu_items if item.get("category") == category]
-    return jsonify({"items": filtered_items})
+    get_menu()
+    return jsonify({"items": _MENU_BY_CATEGORY.get(category, [])})
 
 @app.route("/admin/menu/categories/data")
+@admin_required(denied_json={"error": "Доступ запрещён"})
 def get_categories_data():
     """API для получения данных категорий"""
-    if not session.get("admin_logged_in"):
-        return jsonify({"error": "Доступ запрещён"}), 403
     categories = load_menu_categories()
     return jsonify(categories)
 
 @app.route("/admin/menu/categories")
+@admin_required(flash_denied=True)
 def admin_menu_categories():
     """Страница управления темами (категориями) меню"""
-    if not session.get("admin_logged_in"):
-        flash("❌ Доступ запрещён", "error")
-        return redirect(url_for("admin_login"))
     categories = load_menu_categories()
     return render_template("admin/menu_categories.html", 
                          categories=categories,
                          system_categories=SYSTEM_CATEGORIES)
 
 @app.route("/admin/menu/categories", methods=["POST"])
+@admin_required(flash_denied=True)
 def add_menu_category():
     """Добавление новой темы (категории)"""
-    if not session.get("admin_logged_in"):
-        flash("❌ Доступ запрещён", "error")
-        return redirect(url_for("admin_login"))
     key = request.form.get("category_key", "").strip().lower()
     name = request.form.get("category_name", "").strip()
     if not key or not name:
         flash("❌ Оба поля обязательны для заполнения", "error")
         return redirect(url_for("admin_menu_categories"))
-    if not re.match(r'^[a-z0-9_]+$', key):
+    if not _CATEGORY_KEY_RE.match(key):
          flash("❌ Ключ категории может содержать только латинские буквы в нижнем регистре, цифры и подчеркивание", "error")
          return redirect(url_for("admin_menu_categories"))
     categories = load_menu_categories()
@@ -1593,19 +2128,18 @@ def add_menu_category():
     return redirect(url_for("admin_menu_categories"))
 
 @app.route("/admin/menu/categories/delete/<string:key>")
+@admin_required(flash_denied=True)
 def delete_menu_category(key):
     """Удаление темы (категории)"""
-    if not session.get("admin_logged_in"):
-        flash("❌ Доступ запрещён", "error")
-        return redirect(url_for("admin_login"))
     if key in SYSTEM_CATEGORIES:
         flash("❌ Нельзя удалить системную категорию", "error")
         return redirect(url_for("admin_menu_categories"))
     categories = load_menu_categories()
     if key in categories.get("custom_categories", {}):
         # Проверка: нельзя удалить категорию, если есть кнопки с этой категорией
-        menu_items = load_menu()
-        if any(item.get("category") == key for item in menu_items):
+        # В индексе по категориям есть только категории, к которым привязаны кнопки
+        get_menu()
+        if key in _MENU_BY_CATEGORY:
             flash("❌ Нельзя удалить категорию, к которой привязаны кнопки меню", "error")
             return redirect(url_for("admin_menu_categories"))
         del categories["custom_categories"][key]
@@ -1632,18 +2166,15 @@ def admin_login():
     return render_template("admin/login.html")
 
 @app.route("/admin")
+@admin_required
 def admin_dashboard():
     """Главная админки"""
-    if not session.get("admin_logged_in"):
-        return redirect(url_for("admin_login"))
     return render_template("admin/dashboard.html", bookings=BOOKINGS)
 
 @app.route("/admin/knowledge", methods=["GET", "POST"])
+@admin_required
 def knowledge_edit():
     """Редактирование базы знаний с PostgreSQL"""
-    if not session.get("admin_logged_in"):
-        return redirect(url_for("admin_login"))
-        
     if request.method == "POST":
         action = request.form.get("action")
         question = request.form.get("question", "").strip().lower()
@@ -1691,34 +2222,32 @@ def knowledge_edit():
             else:
                 flash("❌ Введите поисковый запрос", "error")
     
-    # Загружаем актуальные данные из БД
-    load_knowledge_base()
+    # Перечитываем базу из БД только после правок: база загружена при старте,
+    # а просмотр страницы не должен ходить в PostgreSQL
+    global _KB_RELOAD_NEEDED
+    if _KB_RELOAD_NEEDED:
+        _KB_RELOAD_NEEDED = False
+        load_knowledge_base()
     return render_template("admin/knowledge_edit.html", knowledge=KNOWLEDGE_BASE)
 
 @app.route("/admin/logs")
+@admin_required
 def view_logs():
     """Просмотр истории диалогов"""
-    if not session.get("admin_logged_in"):
-        return redirect(url_for("admin_login"))
     logs = []
-    if os.path.exists(LOG_FILE):
-        try:
-            with open(LOG_FILE, "r", encoding="utf-8") as f:
-                content = f.read().strip()
-                if content:
-                    logs = json.loads(content)
-            logs = sorted(logs, key=lambda x: x["timestamp"], reverse=True)
-        except Exception as e:
-            logging.error(f"Ошибка чтения логов: {e}")
-            flash("❌ Ошибка загрузки логов", "error")
+    try:
+        # Лог только дописывается, поэтому последние строки — самые свежие
+        logs = read_jsonl(LOG_FILE, limit=LOGS_VIEW_LIMIT)
+        logs.reverse()
+    except Exception as e:
+        logging.error(f"Ошибка чтения логов: {e}")
+        flash("❌ Ошибка загрузки логов", "error")
     return render_template("admin/logs.html", logs=logs)
 
 @app.route("/admin/edit_response", methods=["POST"])
+@admin_required(denied_json={"status": "error", "message": "Доступ запрещён"})
 def edit_response():
     """Редактирование ответа из логов с сохранением в PostgreSQL"""
-    if not session.get("admin_logged_in"):
-        return jsonify({"status": "error", "message": "Доступ запрещён"}), 403
-        
     question = request.form.get("question")
     new_answer = request.form.get("answer")
     
@@ -1731,12 +2260,14 @@ def edit_response():
     return jsonify({"status": "error", "message": "Некорректные данные"}), 400
 
 @app.route("/admin/export_logs")
+@admin_required
 def export_logs():
     """Экспорт логов диалогов"""
-    if not session.get("admin_logged_in"):
-        return redirect(url_for("admin_login"))
+    flush_jsonl(LOG_FILE)
     if os.path.exists(LOG_FILE):
-        return send_from_directory(".", "bot_log.json", as_attachment=True)
+        # Файл отдается потоком; по ETag/If-Modified-Since и Range повторная
+        # загрузка неизменившегося лога заканчивается 304 или докачкой
+        return send_from_directory(".", LOG_FILE, as_attachment=True, conditional=True, max_age=0)
     flash("❌ Файл логов не найден", "error")
     return redirect(url_for("view_logs"))
 
@@ -1791,16 +2322,17 @@ def get_all_suggestions():
 @app.route("/debug-all-buttons")
 def debug_all_buttons():
     """Диагностика всех кнопок меню"""
-    menu_items = load_menu()
+    menu_items = get_menu()
     debug_info = {}
     
     for item in menu_items:
         topic = item.get("suggestion_topic")
+        suggestions = suggestionMap.get(topic, [])
         debug_info[item["admin_text"]] = {
             "question": item["question"],
             "suggestion_topic": topic,
-            "suggestions_count": len(suggestionMap.get(topic, [])),
-            "suggestions": suggestionMap.get(topic, [])
+            "suggestions_count": len(suggestions),
+            "suggestions": suggestions
         }
     
     return jsonify(debug_info)
@@ -1808,13 +2340,12 @@ def debug_all_buttons():
 @app.route("/debug-platnie-uslugi")
 def debug_platnie_uslugi():
     """Диагностика проблемы с платными услугами"""
-    menu_items = load_menu()
+    menu_items = get_menu()
     platnie_item = None
     
-    for item in menu_items:
-        if item.get("admin_text") == "Платные услуги":
-            platnie_item = item
-            break
+    indexes = _MENU_BY_ADMIN_TEXT.get("Платные услуги")
+    if indexes:
+        platnie_item = menu_items[indexes[0]]
     
     debug_info = {
         "platnie_item": platnie_item,
@@ -1828,7 +2359,7 @@ def debug_platnie_uslugi():
 @app.route("/debug-current-menu")
 def debug_current_menu():
     """Текущее состояние меню"""
-    menu_items = load_menu()
+    menu_items = get_menu()
     return jsonify({
         "menu_items": menu_items,
         "menu_cache": MENU_CACHE is not None
@@ -1837,8 +2368,9 @@ def debug_current_menu():
 @app.route("/clear-cache-now")
 def clear_cache_now():
     """Срочная очистка кэша меню"""
-    global MENU_CACHE
+    global MENU_CACHE, MENU_CATEGORIES_CACHE
     MENU_CACHE = None
+    MENU_CATEGORIES_CACHE = None
     load_menu()
     return "✅ Кэш меню очищен! Теперь обновите страницу чата."
 
@@ -1857,14 +2389,17 @@ def debug_normalize():
     
     results = []
     for q in test_questions:
+        normalized = normalize_text(q)
         results.append({
             "original": q,
-            "normalized": normalize_text(q),
-            "in_knowledge_base": normalize_text(q) in [normalize_text(k) for k in KNOWLEDGE_BASE.keys()]
+            "normalized": normalized,
+            # Ключи индекса _KB_NORM — нормализованные вопросы базы знаний
+            "in_knowledge_base": normalized in _KB_NORM
         })
     
     return jsonify(results)
 
+@functools.lru_cache(maxsize=1)
 def get_local_ip():
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -1876,24 +2411,33 @@ def get_local_ip():
         print(f"❌ Ошибка определения IP: {e}")
         return "127.0.0.1"
 
+# Системное сообщение Yandex GPT: одно на все вызовы
+_GPT_SYSTEM_MESSAGE = {"role": "system", "text": """
+    Ты - консультант стоматологической поликлиники. Отвечай дружелюбно и информативно.
+    Используй профессиональные знания стоматолога, соблюдай врачебную этику.
+    Ты – дружелюбный консультант стоматолог. Отвечай кратко, структурированно.
+    Если пользователь хочет узнать про услуги поликлиники:
+    Предложи задавать тебе вопросы или связаться со специалистом.
+    Не выдумывай цены – если не знаешь, скажи честно, но предложи помощь.
+    Всегда завершай свой ответ открытым вопросом, чтобы продолжить диалог.
+    """}
+
 def call_yandex_gpt(prompt, history=None):
     """Вызов Yandex GPT с повторными попытками"""
+    # Одинаковые вопросы без истории диалога отдаем из кэша
+    cache_key = normalize_text(prompt) if not history else None
+    if cache_key is not None:
+        with _GPT_CACHE_LOCK:
+            cached = _GPT_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
     url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
     headers = {
         "Authorization": f"Api-Key {os.getenv('YANDEX_API_KEY')}",
         "x-folder-id": os.getenv("YANDEX_FOLDER_ID"),
         "Content-Type": "application/json"
     }
-    system_prompt = """
-    Ты - консультант стоматологической поликлиники. Отвечай дружелюбно и информативно.
-    Используй профессиональные знания стоматолога, соблюдай врачебную этику.
-    Ты – дружелюбный консультант стоматолог. Отвечай кратко, структурированно.
-    Если пользователь хочет узнать про услуги поликлиники:
-    Предложи задавать тебе вопросы или связаться со специалистом.
-    Не выдумывай цены – если не знаешь, скажи честно, но предложи помощь.
-    Всегда завершай свой ответ открытым вопросом, чтобы продолжить диалог.
-    """
-    messages = [{"role": "system", "text": system_prompt}]
+    messages = [_GPT_SYSTEM_MESSAGE]
     if history:
         messages.extend(history)
     messages.append({"role": "user", "text": prompt})
@@ -1906,298 +2450,583 @@ def call_yandex_gpt(prompt, history=None):
         },
         "messages": messages
     }
-    for attempt in range(3):
+    # Тело запроса сериализуем один раз на все попытки
+    body = orjson.dumps(payload) if ORJSON_AVAILABLE else json.dumps(payload).encode("utf-8")
+    for attempt in range(GPT_ATTEMPTS):
+        retry_after = None
         try:
-            response = requests.post(url, headers=headers, json=payload, timeout=10)
+            response = _HTTP.post(url, headers=headers, data=body, timeout=(3, 10))
             if response.status_code == 200:
-                return response.json()["result"]["alternatives"][0]["message"]["text"]
+                answer = response.json()["result"]["alternatives"][0]["message"]["text"]
+                if cache_key is not None:
+                    with _GPT_CACHE_LOCK:
+                        _GPT_CACHE[cache_key] = answer
+                return answer
             elif response.status_code == 401:
                 return "❌ Ошибка авторизации. Проверьте API-ключ."
             elif response.status_code == 400:
                 return "❌ Ошибка параметров. Проверьте folder_id."
             else:
                 print(f"⚠️ Ошибка GPT (попытка {attempt + 1}): {response.status_code}")
+                # Повторяем только 5xx и 429, прочие ошибки клиента повтор не исправит
+                if response.status_code < 500 and response.status_code != 429:
+                    break
+                retry_after = response.headers.get("Retry-After")
         except requests.exceptions.RequestException as e:
             print(f"⚠️ Ошибка подключения (попытка {attempt + 1}): {str(e)}")
-        time.sleep(1)
+        if attempt + 1 < GPT_ATTEMPTS:
+            time.sleep(gpt_retry_delay(attempt, retry_after))
     return "❌ Не удалось получить ответ. Попробуйте позже."
 
+def gpt_retry_delay(attempt, retry_after=None):
+    """Пауза перед повтором: Retry-After сервера или случайная в [0, min(cap, base * 2^attempt)]"""
+    if retry_after:
+        try:
+            return min(GPT_RETRY_CAP, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+    return random.uniform(0, min(GPT_RETRY_CAP, GPT_RETRY_BASE * (2 ** attempt)))
+
+# - Лог диалогов: очередь записей, пишет фоновый поток пачками -
+LOG_QUEUE = queue.Queue()
+LOG_BATCH_SIZE = 50
+LOG_BATCH_WAIT = 0.2  # сек
+_LOG_LOCK = threading.Lock()
+_LOG_COUNT = 0  # счетчик записей для периодических резервных копий
+
 def log_interaction(question, answer, source):
-    """Логирует диалог в bot_log.json"""
-    log_entry = {
+    """Ставит диалог в очередь записи в bot_log.jsonl"""
+    LOG_QUEUE.put({
         "timestamp": datetime.now().isoformat(),
         "question": question,
         "answer": answer,
         "source": source
-    }
+    })
+
+def _write_log_batch(batch):
+    """Дописывает пачку диалогов в лог одной записью на диск"""
+    global _LOG_COUNT
     try:
-        logs = []
-        if os.path.exists(LOG_FILE):
-            with open(LOG_FILE, "r", encoding="utf-8") as f:
-                content = f.read().strip()
-                if content:
-                    logs = json.loads(content)
-        logs.append(log_entry)
-        if len(logs) % 100 == 0:
-            backup_path = os.path.join(BACKUPS_DIR, f"bot_log_{int(time.time())}.json")
-            shutil.copy2(LOG_FILE, backup_path)
-            print(f"🔄 Создана резервная копия: {backup_path}")
-        with open(LOG_FILE, "w", encoding="utf-8") as f:
-            json.dump(logs, f, ensure_ascii=False, indent=4)
-        print("✅ Диалог сохранен в лог")
-        logging.info("Диалог сохранен в лог")
+        with _LOG_LOCK:
+            for log_entry in batch:
+                append_jsonl(LOG_FILE, log_entry)
+            flush_jsonl(LOG_FILE)
+            previous = _LOG_COUNT
+            _LOG_COUNT += len(batch)
+            if _LOG_COUNT // 100 > previous // 100:
+                backup_path = os.path.join(BACKUPS_DIR, f"bot_log_{int(time.time())}.jsonl")
+                shutil.copy2(LOG_FILE, backup_path)
+                print(f"🔄 Создана резервная копия: {backup_path}")
+        print(f"✅ Диалогов сохранено в лог: {len(batch)}")
+        logging.info(f"Диалогов сохранено в лог: {len(batch)}")
     except Exception as e:
         print(f"❌ Ошибка сохранения лога: {e}")
         logging.error(f"Ошибка сохранения лога: {e}")
 
-# ===================================================================================
-# 🔊 НОВЫЙ МАРШРУТ: TTS через Yandex SpeechKit
-# ===================================================================================
+def _drain_log_queue(block=True):
+    """Забирает из очереди пачку: до LOG_BATCH_SIZE записей или LOG_BATCH_WAIT секунд"""
+    batch = []
+    if block:
+        batch.append(LOG_QUEUE.get())
+        deadline = time.monotonic() + LOG_BATCH_WAIT
+        while len(batch) < LOG_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(LOG_QUEUE.get(timeout=timeout))
+            except queue.Empty:
+                break
+    else:
+        while True:
+            try:
+                batch.append(LOG_QUEUE.get_nowait())
+            except queue.Empty:
+                break
+    return batch
 
-@app.route('/tts')
-def text_to_speech():
-    """
-    Преобразует текст или SSML в речь через Yandex SpeechKit.
-    Поддержка пауз, голосов и интонаций через <speak> и <break>
-    """
-    text = request.args.get('text', '').strip()
-    use_ssml = request.args.get('ssml', 'false').lower() == 'true'
-    voice = request.args.get('voice', 'alena')  # Можно менять голос
-    if not text:
-        return '', 400
+def _log_worker():
+    """Фоновый поток записи лога диалогов"""
+    while True:
+        _write_log_batch(_drain_log_queue())
 
-    # Декодируем URL-encoded текст
-    text = unquote(text)
-    
-    # Функция для преобразования чисел в порядковые числительные для списков
-    def convert_number_to_text(number):
-        numbers = {
-            1: 'первое',
-            2: 'второе', 
-            3: 'третье',
-            4: 'четвертое',
-            5: 'пятое',
-            6: 'шестое',
-            7: 'седьмое',
-            8: 'восьмое',
-            9: 'девятое',
-            10: 'десятое',
-            11: 'одиннадцатое',
-            12: 'двенадцатое',
-            13: 'тринадцатое',
-            14: 'четырнадцатое',
-            15: 'пятнадцатое',
-            16: 'шестнадцатое',
-            17: 'семнадцатое',
-            18: 'восемнадцатое',
-            19: 'девятнадцатое',
-            20: 'двадцатоe'
-        }
-        return numbers.get(number, str(number))
-    
-    # Функция для преобразования дат
-    def convert_day_to_text(day):
-        days = {
-            1: 'первое', 2: 'второе', 3: 'третье', 4: 'четвертое', 5: 'пятое',
-            6: 'шестое', 7: 'седьмое', 8: 'восьмое', 9: 'девятое', 10: 'десятое',
-            11: 'одиннадцатое', 12: 'двенадцатое', 13: 'тринадцатое', 14: 'четырнадцатое',
-            15: 'пятнадцатое', 16: 'шестнадцатое', 17: 'семнадцатое', 18: 'восемнадцатое',
-            19: 'девятнадцатое', 20: 'двадцатое', 21: 'двадцать первое', 22: 'двадцать второе',
-            23: 'двадцать третье', 24: 'двадцать четвертое', 25: 'двадцать пятое',
-            26: 'двадцать шестое', 27: 'двадцать седьмое', 28: 'двадцать восьмое',
-            29: 'двадцать девятое', 30: 'тридцатое', 31: 'тридцать первое'
-        }
-        return days.get(day, str(day))
-    
-    # Обрабатываем текст для TTS
-   
-       # Обрабатываем текст для TTS
-    import re
-    
-    # Функция для определения телефонных номеров
-    def is_phone_number(text):
-        phone_patterns = [
-            r'\(\d{3}\)\s?\d{3}\s?\d{2}\s?\d{2}',  # (495) 123 45 67
-            r'\d{3}-\d{2}-\d{2}',                   # 123-45-67
-            r'\d{3}\s\d{2}\s\d{2}',                 # 123 45 67
-        ]
-        return any(re.search(pattern, text) for pattern in phone_patterns)
-
-    # Функция для преобразования отдельных цифр
-    def convert_single_digit(digit):
-        digits = {
-            0: 'ноль',
-            1: 'один', 
-            2: 'два',
-            3: 'три',
-            4: 'четыре',
-            5: 'пять',
-            6: 'шесть',
-            7: 'семь',
-            8: 'восемь',
-            9: 'девять'
-        }
-        return digits.get(digit, str(digit))
+def flush_log_queue():
+    """Дописывает в лог все, что осталось в очереди (при остановке процесса)"""
+    batch = _drain_log_queue(block=False)
+    if batch:
+        _write_log_batch(batch)
 
-    # Функция для преобразования двузначных чисел
-    def convert_two_digit_number(number):
-        if number < 10:
-            return convert_single_digit(number)
-        
-        numbers = {
-            10: 'десять',
-            11: 'одиннадцать',
-            12: 'двенадцать', 
-            13: 'тринадцать',
-            14: 'четырнадцать',
-            15: 'пятнадцать',
-            16: 'шестнадцать',
-            17: 'семнадцать',
-            18: 'восемнадцать',
-            19: 'девятнадцать',
-            20: 'двадцать',
-            30: 'тридцать',
-            40: 'сорок',
-            50: 'пятьдесят',
-            60: 'шестьдесят',
-            70: 'семьдесят',
-            80: 'восемьдесят',
-            90: 'девяносто'
-        }
-        
-        if number in numbers:
-            return numbers[number]
-        else:
-            tens = (number // 10) * 10
-            units = number % 10
-            if units == 0:
-                return numbers.get(tens, str(tens))
-            else:
-                return f"{numbers.get(tens, str(tens))} {convert_single_digit(units)}"
-
-        # Функция для преобразования телефонных номеров
-    def convert_phone_number(text):
-        def replace_phone_numbers(match):
-            # Извлекаем все числа из телефонного номера
-            numbers = re.findall(r'\d+', match.group())
-            result = []
-            
-            for num in numbers:
-                if num == '00':  # Особый случай для двойного нуля
-                    result.append('ноль ноль')
-                elif len(num) == 1:  # Одиночные цифры
-                    result.append(convert_single_digit(int(num)))
-                elif len(num) == 2:  # Двузначные числа
-                    # В телефонах двузначные числа обычно произносятся как целые числа
-                    result.append(convert_two_digit_number(int(num)))
-                else:  # Трехзначные и более (коды городов)
-                    # Произносим по отдельным цифрам
-                    result.append(' '.join([convert_single_digit(int(d)) for d in num]))
-            
-            return ' '.join(result)
-        
-        # Паттерн для телефонных номеров
-        phone_pattern = r'\(\d{3}\)\s?\d{3}\s?\d{2}\s?\d{2}'
-        return re.sub(phone_pattern, replace_phone_numbers, text)
+threading.Thread(target=_log_worker, name="log-writer", daemon=True).start()
+atexit.register(flush_log_queue)
 
+# ===================================================================================
+# 🔊 НОВЫЙ МАРШРУТ: TTS через Yandex SpeechKit
+# ===================================================================================
+
+# Регулярные выражения подготовки текста для TTS (компилируются один раз)
+# Все форматы телефона одной альтернативой: поиск и замена за один проход.
+# Словами произносится только номер с кодом в скобках (группа spoken)
+_TTS_PHONE_RE = re.compile(
+    r'(?P<spoken>\(\d{3}\)\s?\d{3}\s?\d{2}\s?\d{2})'  # (495) 123 45 67
+    r'|\d{3}-\d{2}-\d{2}'                             # 123-45-67
+    r'|\d{3}\s\d{2}\s\d{2}'                           # 123 45 67
+)
+_TTS_DIGITS_RE = re.compile(r'\d+')
+# Даты (дд.мм.гггг) и номера пунктов списка (1., 2., ...) за один проход
+_TTS_DATE_OR_LIST_RE = re.compile(
+    r'(?P<day>\d{2})\.(?P<month>\d{2})\.(?P<year>\d{4})'
+    r'|(?P<item>\d+)\.\s+'
+)
+_TTS_PARAGRAPH_RE = re.compile(r'\n\s*\n')
+_TTS_MARKDOWN_RE = re.compile(r'\*\*|\*|~~|`')
+# Очистка ответа бота перед озвучкой: ссылки, картинки и служебные символы Markdown
+_TTS_ANSWER_MARKDOWN_RES = (
+    (re.compile(r'\*\*(.*?)\*\*'), r'\1'),
+    (re.compile(r'\*(.*?)\*'), r'\1'),
+    (re.compile(r'~~(.*?)~~'), r'\1'),
+    (re.compile(r'`(.*?)`'), r'\1'),
+    (re.compile(r'!\[.*?\]\(.*?\)'), ''),
+    (re.compile(r'\[([^\]]+)\]\([^)]+\)'), r'\1'),
+    (re.compile(r'[#>*\-+=\[\]{}()|]'), ' '),
+)
+_TTS_DATE_RE = re.compile(r'(\d{2})\.(\d{2})\.(\d{4})')
+_TTS_DECIMAL_RE = re.compile(r'(\d+)\.(\d+)')
+_TTS_SEPARATOR_RE = re.compile(r'[_/]')
+
+# Аудио SpeechKit отдаем кусками по 64 КБ (размер типичного приемного буфера TCP)
+TTS_CHUNK_SIZE = 64 * 1024
+# Лимит SpeechKit (v1) 5000 символов; 4000 оставляет запас на обертку <speak>…</speak> и разметку SSML
+TTS_MAX_TEXT_LENGTH = 4000
+_TTS_MIMETYPES = {"mp3": "audio/mpeg", "lpcm": "audio/x-pcm"}
+
+# - Кэш синтезированного аудио на диске: повторные фразы не ходят в SpeechKit -
+TTS_CACHE_DIR = "tts_cache"
+TTS_CACHE_MAX_FILES = 1000
+os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+
+# - Предохранитель SpeechKit: после серии сбоев не ходим в API на время паузы -
+TTS_BREAKER_THRESHOLD = 3
+TTS_BREAKER_COOLDOWN = 30  # сек
+_TTS_BREAKER_LOCK = threading.Lock()
+_TTS_FAIL_COUNT = 0
+_TTS_COOLDOWN_UNTIL = 0.0
+
+def tts_breaker_open():
+    """True, если после серии сбоев SpeechKit еще идет пауза"""
+    return time.monotonic() < _TTS_COOLDOWN_UNTIL
+
+def record_tts_result(ok):
+    """Учитывает результат вызова SpeechKit: успех сбрасывает счетчик сбоев"""
+    global _TTS_FAIL_COUNT, _TTS_COOLDOWN_UNTIL
+    with _TTS_BREAKER_LOCK:
+        if ok:
+            _TTS_FAIL_COUNT = 0
+            return
+        _TTS_FAIL_COUNT += 1
+        if _TTS_FAIL_COUNT >= TTS_BREAKER_THRESHOLD:
+            _TTS_FAIL_COUNT = 0
+            _TTS_COOLDOWN_UNTIL = time.monotonic() + TTS_BREAKER_COOLDOWN
+            print(f"⚠️ SpeechKit недоступен, пауза {TTS_BREAKER_COOLDOWN} сек")
+
+def tts_cache_key(voice, audio_format, text):
+    """Имя файла кэша по голосу, формату и итоговому тексту"""
+    return hashlib.sha1(f"{voice}\n{audio_format}\n{text}".encode("utf-8")).hexdigest()
+
+def _tee_to_tts_cache(chunks, path):
+    """Отдает куски аудио клиенту и пишет их в кэш; файл появляется только целиком"""
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(tmp_path, path)
+    finally:
+        # Обрыв клиента или ошибка SpeechKit: недописанный файл не оставляем
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _prune_tts_cache()
+
+def _prune_tts_cache():
+    """Удаляет давно не использованные файлы кэша сверх TTS_CACHE_MAX_FILES"""
+    try:
+        entries = [entry for entry in os.scandir(TTS_CACHE_DIR)
+                   if entry.is_file() and not entry.name.endswith(".tmp")]
+        if len(entries) <= TTS_CACHE_MAX_FILES:
+            return
+        # Время изменения обновляется при каждом попадании в кэш
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - TTS_CACHE_MAX_FILES]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+    except OSError as e:
+        print(f"⚠️ Ошибка очистки кэша TTS: {e}")
+
+# Порядковые числительные для нумерованных списков
+_TTS_LIST_ORDINALS = {
+    1: 'первое',
+    2: 'второе', 
+    3: 'третье',
+    4: 'четвертое',
+    5: 'пятое',
+    6: 'шестое',
+    7: 'седьмое',
+    8: 'восьмое',
+    9: 'девятое',
+    10: 'десятое',
+    11: 'одиннадцатое',
+    12: 'двенадцатое',
+    13: 'тринадцатое',
+    14: 'четырнадцатое',
+    15: 'пятнадцатое',
+    16: 'шестнадцатое',
+    17: 'семнадцатое',
+    18: 'восемнадцатое',
+    19: 'девятнадцатое',
+    20: 'двадцатоe'
+}
+
+# Числа месяца для дат
+_TTS_DAY_ORDINALS = {
+    1: 'первое', 2: 'второе', 3: 'третье', 4: 'четвертое', 5: 'пятое',
+    6: 'шестое', 7: 'седьмое', 8: 'восьмое', 9: 'девятое', 10: 'десятое',
+    11: 'одиннадцатое', 12: 'двенадцатое', 13: 'тринадцатое', 14: 'четырнадцатое',
+    15: 'пятнадцатое', 16: 'шестнадцатое', 17: 'семнадцатое', 18: 'восемнадцатое',
+    19: 'девятнадцатое', 20: 'двадцатое', 21: 'двадцать первое', 22: 'двадцать второе',
+    23: 'двадцать третье', 24: 'двадцать четвертое', 25: 'двадцать пятое',
+    26: 'двадцать шестое', 27: 'двадцать седьмое', 28: 'двадцать восьмое',
+    29: 'двадцать девятое', 30: 'тридцатое', 31: 'тридцать первое'
+}
+
+# Годы в датах (родительный падеж): 2025 -> "две тысячи двадцать пятого"
+_TTS_YEAR_ORDINALS = {
+    1: 'первого', 2: 'второго', 3: 'третьего', 4: 'четвертого', 5: 'пятого',
+    6: 'шестого', 7: 'седьмого', 8: 'восьмого', 9: 'девятого', 10: 'десятого',
+    11: 'одиннадцатого', 12: 'двенадцатого', 13: 'тринадцатого', 14: 'четырнадцатого',
+    15: 'пятнадцатого', 16: 'шестнадцатого', 17: 'семнадцатого', 18: 'восемнадцатого',
+    19: 'девятнадцатого', 20: 'двадцатого', 30: 'тридцатого', 40: 'сорокового',
+    50: 'пятидесятого', 60: 'шестидесятого', 70: 'семидесятого', 80: 'восьмидесятого',
+    90: 'девяностого'
+}
+
+_TTS_DIGITS = {
+    0: 'ноль',
+    1: 'один', 
+    2: 'два',
+    3: 'три',
+    4: 'четыре',
+    5: 'пять',
+    6: 'шесть',
+    7: 'семь',
+    8: 'восемь',
+    9: 'девять'
+}
+
+_TTS_TWO_DIGIT_NUMBERS = {
+    10: 'десять',
+    11: 'одиннадцать',
+    12: 'двенадцать', 
+    13: 'тринадцать',
+    14: 'четырнадцать',
+    15: 'пятнадцать',
+    16: 'шестнадцать',
+    17: 'семнадцать',
+    18: 'восемнадцать',
+    19: 'девятнадцать',
+    20: 'двадцать',
+    30: 'тридцать',
+    40: 'сорок',
+    50: 'пятьдесят',
+    60: 'шестьдесят',
+    70: 'семьдесят',
+    80: 'восемьдесят',
+    90: 'девяносто'
+}
+
+_TTS_MONTHS = (
+    '', 'января', 'февраля', 'марта', 'апреля', 'мая', 'июня',
+    'июля', 'августа', 'сентября', 'октября', 'ноября', 'декабря'
+)
+
+def convert_number_to_text(number):
+    """Преобразует номер пункта списка в порядковое числительное"""
+    return _TTS_LIST_ORDINALS.get(number, str(number))
+
+def convert_day_to_text(day):
+    """Преобразует число месяца в порядковое числительное"""
+    return _TTS_DAY_ORDINALS.get(day, str(day))
+
+def convert_single_digit(digit):
+    """Цифра словом"""
+    return _TTS_DIGITS.get(digit, str(digit))
+
+@functools.lru_cache(maxsize=256)
+def convert_two_digit_number(number):
+    """Двузначное число словами"""
+    if number < 10:
+        return convert_single_digit(number)
+    if number in _TTS_TWO_DIGIT_NUMBERS:
+        return _TTS_TWO_DIGIT_NUMBERS[number]
+    tens = (number // 10) * 10
+    units = number % 10
+    if units == 0:
+        return _TTS_TWO_DIGIT_NUMBERS.get(tens, str(tens))
+    return f"{_TTS_TWO_DIGIT_NUMBERS.get(tens, str(tens))} {convert_single_digit(units)}"
+
+def _replace_phone_number(match):
+    """Телефонный номер словами для подстановки в re.sub"""
+    if match.group("spoken") is None:
+        return match.group()
+    # Извлекаем все числа из телефонного номера
+    numbers = _TTS_DIGITS_RE.findall(match.group())
+    result = []
+
+    for num in numbers:
+        if num == '00':  # Особый случай для двойного нуля
+            result.append('ноль ноль')
+        elif len(num) == 1:  # Одиночные цифры
+            result.append(convert_single_digit(int(num)))
+        elif len(num) == 2:  # Двузначные числа
+            # В телефонах двузначные числа обычно произносятся как целые числа
+            result.append(convert_two_digit_number(int(num)))
+        else:  # Трехзначные и более (коды городов)
+            # Произносим по отдельным цифрам
+            result.append(' '.join([convert_single_digit(int(d)) for d in num]))
+
+    return ' '.join(result)
+
+def convert_phone_numbers(text):
+    """Заменяет телефонные номера в тексте их произношением; возвращает (текст, число номеров)"""
+    return _TTS_PHONE_RE.subn(_replace_phone_number, text)
+
+def _replace_date_or_list_number(match):
+    """Дата или номер пункта списка словами для подстановки в re.sub"""
+    if match.group("item") is not None:
+        return f"{convert_number_to_text(int(match.group('item')))}. "
+    return date_to_text(int(match.group("day")), int(match.group("month")), int(match.group("year")))
+
+@functools.lru_cache(maxsize=256)
+def date_to_text(day, month, year):
+    """Дата словами; повторяющиеся даты берутся из кэша"""
+    day_text = convert_day_to_text(day)
+    month_text = _TTS_MONTHS[month] if 1 <= month <= 12 else str(month)
+
+    # Годы 2000-2099 словами, остальные числом
+    year_text = str(year)
+    if year == 2000:
+        year_text = "двухтысячного"
+    elif 2000 < year < 2100:
+        rest = year - 2000
+        ordinal = _TTS_YEAR_ORDINALS.get(rest)
+        if ordinal is None:
+            ordinal = f"{_TTS_TWO_DIGIT_NUMBERS[rest // 10 * 10]} {_TTS_YEAR_ORDINALS[rest % 10]}"
+        year_text = f"две тысячи {ordinal}"
+
+    return f"{day_text} {month_text} {year_text} года"
+
+_TTS_URL = "https://tts.api.cloud.yandex.net/speech/v1/tts:synthesize"
+
+def build_tts_request(text, use_ssml, voice):
+    """Готовит текст к озвучке и собирает параметры запроса к SpeechKit"""
     # Основная обработка текста
-    if is_phone_number(text):
-        processed_text = convert_phone_number(text)
-    else:
+    processed_text, phone_count = convert_phone_numbers(text)
+    if not phone_count:
         # Обычная обработка для не-телефонных текстов
-        # Преобразуем нумерованные списки (1., 2., 3. и т.д.)
-        processed_text = re.sub(r'(\d+)\.\s+', lambda m: f"{convert_number_to_text(int(m.group(1)))}. ", text)
+        # Преобразуем даты (дд.мм.гггг) и нумерованные списки (1., 2., 3. и т.д.)
+        processed_text = _TTS_DATE_OR_LIST_RE.sub(_replace_date_or_list_number, text)
         
-        # Преобразуем даты (дд.мм.гггг)
-        date_pattern = r'(\d{2})\.(\d{2})\.(\d{4})'
-        def replace_date(match):
-            day = int(match.group(1))
-            month = int(match.group(2))
-            year = int(match.group(3))
-            
-            months = [
-                '', 'января', 'февраля', 'марта', 'апреля', 'мая', 'июня',
-                'июля', 'августа', 'сентября', 'октября', 'ноября', 'декабря'
-            ]
-            
-            day_text = convert_day_to_text(day)
-            month_text = months[month] if 1 <= month <= 12 else str(month)
-            
-            # Простое преобразование года
-            year_text = str(year)
-            if year >= 2000:
-                year_text = f"две тысячи {convert_number_to_text(year - 2000)}" if year > 2000 else "двухтысячного"
-            
-            return f"{day_text} {month_text} {year_text} года"
-        
-        processed_text = re.sub(date_pattern, replace_date, processed_text)
-        
-        # Добавляем паузы между абзацами
-        processed_text = re.sub(r'\n\s*\n', ' <break time="900ms"/> ', processed_text)
+        # Добавляем паузы между абзацами (<break> действует только внутри <speak>)
+        if use_ssml:
+            processed_text = _TTS_PARAGRAPH_RE.sub(' <break time="900ms"/> ', processed_text)
         
         # Убираем лишние пробелы
-        processed_text = re.sub(r'\s+', ' ', processed_text).strip()
+        processed_text = _WS_RE.sub(' ', processed_text).strip()
     
     # Убираем Markdown-разметку
-    processed_text = re.sub(r'\*\*|\*|~~|`', '', processed_text)
-    
-    url = "https://tts.api.cloud.yandex.net/speech/v1/tts:synthesize"
-    headers = {
-        "Authorization": f"Api-Key {os.getenv('YANDEX_API_KEY')}"
-    }
+    processed_text = _TTS_MARKDOWN_RE.sub('', processed_text)
 
     # Если use_ssml=True — обрамляем текст в <speak>
     final_text = f"<speak>{processed_text}</speak>" if use_ssml else processed_text
 
-    data = {
+    # Для SSML используем PCM, для обычного текста mp3
+    return {
         "text": final_text,
         "lang": "ru-RU",
         "voice": voice,
-        "format": "mp3",
+        "format": "lpcm" if use_ssml else "mp3",
         "sampleRateHertz": 48000
     }
 
-    # Для SSML можно использовать PCM (если нужно)
-    if use_ssml:
-        data["format"] = "lpcm"
-        data["sampleRateHertz"] = 48000
+def _tts_headers():
+    """Заголовки авторизации SpeechKit"""
+    return {"Authorization": f"Api-Key {os.getenv('YANDEX_API_KEY')}"}
+
+# - Предварительный синтез: ответ озвучивается, пока браузер получает текст -
+_TTS_PREFETCH_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="tts-prefetch")
+_TTS_INFLIGHT = {}  # ключ кэша -> Future синтеза, который еще идет
+_TTS_INFLIGHT_LOCK = threading.Lock()
+TTS_PREFETCH_WAIT = 10  # сек: сколько /tts ждет уже идущий синтез той же фразы
+
+def prepare_tts(text, use_ssml, voice):
+    """Текст параметра /tts -> (параметры SpeechKit, ключ кэша, путь к файлу кэша).
+    Общий путь для /tts и предварительного синтеза, поэтому их ключи совпадают"""
+    # Декодируем URL-encoded текст
+    data = build_tts_request(unquote(text), use_ssml, voice)
+    cache_key = tts_cache_key(voice, data["format"], data["text"])
+    return data, cache_key, os.path.join(TTS_CACHE_DIR, cache_key)
+
+def tts_text_for_answer(answer):
+    """Текст ответа для озвучки: без Markdown, даты и дроби словами.
+    Браузер передает его в /tts как есть, предварительный синтез берет его же"""
+    text = answer
+    for pattern, replacement in _TTS_ANSWER_MARKDOWN_RES:
+        text = pattern.sub(replacement, text)
+    text = _TTS_DATE_RE.sub(lambda m: date_to_text(int(m.group(1)), int(m.group(2)), int(m.group(3))), text)
+    text = _TTS_DECIMAL_RE.sub(r'\1 точка \2', text)
+    text = _TTS_SEPARATOR_RE.sub(' ', text)
+    return _WS_RE.sub(' ', text).strip()
+
+def _synthesize_to_cache(data, cache_path):
+    """Синтезирует аудио в кэш без отдачи клиенту"""
+    try:
+        tts_response = _HTTP.post(_TTS_URL, headers=_tts_headers(), data=data, stream=True, timeout=(3, 10))
+        with tts_response:
+            if tts_response.status_code != 200:
+                print("TTS prefetch error:", tts_response.status_code)
+                record_tts_result(tts_response.status_code < 500)
+                return
+            record_tts_result(True)
+            for _ in _tee_to_tts_cache(tts_response.iter_content(chunk_size=TTS_CHUNK_SIZE), cache_path):
+                pass
+    except Exception as e:
+        print("TTS prefetch failed:", str(e))
+        record_tts_result(False)
+
+def prefetch_tts(tts_text, voice="alena"):
+    """Запускает фоновый синтез tts_text в кэш TTS (как его запросит браузер)"""
+    if not tts_text or len(tts_text) > TTS_MAX_TEXT_LENGTH or tts_breaker_open():
+        return
+    data, cache_key, cache_path = prepare_tts(tts_text, False, voice)
+    with _TTS_INFLIGHT_LOCK:
+        if cache_key in _TTS_INFLIGHT or os.path.exists(cache_path):
+            return
+        future = _TTS_PREFETCH_EXECUTOR.submit(_synthesize_to_cache, data, cache_path)
+        _TTS_INFLIGHT[cache_key] = future
+    future.add_done_callback(lambda _: _TTS_INFLIGHT.pop(cache_key, None))
+
+@app.route('/tts')
+def text_to_speech():
+    """
+    Преобразует текст или SSML в речь через Yandex SpeechKit.
+    Поддержка пауз, голосов и интонаций через <speak> и <break>
+    """
+    text = request.args.get('text', '').strip()
+    use_ssml = request.args.get('ssml', 'false').lower() == 'true'
+    voice = request.args.get('voice', 'alena')  # Можно менять голос
+    if not text:
+        return '', 400
+    # Слишком длинный текст отклоняем до регулярных выражений и запроса в SpeechKit
+    if len(text) > TTS_MAX_TEXT_LENGTH:
+        return 'Текст слишком длинный', 413
+
+    data, cache_key, cache_path = prepare_tts(text, use_ssml, voice)
+    mimetype = _TTS_MIMETYPES[data["format"]]
+    # Эта фраза уже синтезируется заранее: дожидаемся файла в кэше
+    future = _TTS_INFLIGHT.get(cache_key)
+    if future is not None:
+        try:
+            future.result(timeout=TTS_PREFETCH_WAIT)
+        except Exception:
+            pass
+    if os.path.exists(cache_path):
+        try:
+            os.utime(cache_path)
+            return send_from_directory(TTS_CACHE_DIR, cache_key, mimetype=mimetype, conditional=True)
+        except OSError:
+            pass  # Файл только что вытеснен из кэша: синтезируем заново
+
+    if tts_breaker_open():
+        return '', 503
 
     try:
-        tts_response = requests.post(url, headers=headers, data=data, stream=True)
+        tts_response = _HTTP.post(_TTS_URL, headers=_tts_headers(), data=data, stream=True, timeout=(3, 10))
         if tts_response.status_code != 200:
             print("TTS Error:", tts_response.text)
+            # Ошибки запроса (4xx) не говорят о недоступности SpeechKit
+            record_tts_result(tts_response.status_code < 500)
+            tts_response.close()
             return '', 500
+        record_tts_result(True)
 
-        return Response(
-            tts_response.iter_content(chunk_size=1024),
-            mimetype="audio/mpeg"  # или "audio/x-lpcm", если format=lpcm
+        response = Response(
+            _tee_to_tts_cache(tts_response.iter_content(chunk_size=TTS_CHUNK_SIZE), cache_path),
+            mimetype=mimetype
         )
+        # Соединение возвращается в пул сессии после отдачи ответа клиенту
+        response.call_on_close(tts_response.close)
+        return response
     except Exception as e:
         print("TTS Request failed:", str(e))
+        record_tts_result(False)
         return '', 500
 
 # ===================================================================================
 
+# - Импорт базы знаний: ijson разбирает тело запроса потоком, не целиком -
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
+
+KB_IMPORT_BATCH = 500
+
+def _iter_import_items():
+    """Пары (вопрос, ответ) из JSON-объекта в теле запроса; None, если тело не объект"""
+    if IJSON_AVAILABLE:
+        # BufferedReader: ijson проверяет поток вызовом read(0), а поток
+        # werkzeug принимает пустое чтение за обрыв соединения
+        events = ijson.parse(io.BufferedReader(request.stream))
+        first = next(events)
+        if first[1] != "start_map":
+            return None
+        return ijson.kvitems(itertools.chain([first], events), "")
+    data = request.json
+    if not isinstance(data, dict):
+        return None
+    return iter(data.items())
+
 @app.route("/admin/knowledge/import", methods=["POST"])
+@admin_required(denied_json={"success": False, "error": "Доступ запрещён"})
 def import_knowledge():
     """Массовый импорт вопросов-ответов"""
-    if not session.get("admin_logged_in"):
-        return jsonify({"success": False, "error": "Доступ запрещён"}), 403
-        
     try:
-        data = request.json
-        if not data or not isinstance(data, dict):
+        if not request.is_json:
             return jsonify({"success": False, "error": "Некорректные данные"})
-            
+
+        items = _iter_import_items()
+        if items is None:
+            return jsonify({"success": False, "error": "Некорректные данные"}), 400
+
+        created_by = session.get("admin_user", "admin")
         success_count = 0
         error_count = 0
-        
-        for question, answer in data.items():
+        batch = []
+        # Записываем пачками по KB_IMPORT_BATCH, не дожидаясь конца тела запроса
+        for question, answer in items:
             if question and answer:
-                if add_knowledge_item(question, answer, session.get("admin_user", "admin")):
-                    success_count += 1
-                else:
-                    error_count += 1
+                batch.append((question, answer))
+                if len(batch) >= KB_IMPORT_BATCH:
+                    saved, failed = add_knowledge_items_bulk(batch, created_by)
+                    success_count += saved
+                    error_count += failed
+                    batch = []
+        if batch:
+            saved, failed = add_knowledge_items_bulk(batch, created_by)
+            success_count += saved
+            error_count += failed
         
         return jsonify({
             "success": True,
@@ -2210,6 +3039,7 @@ def import_knowledge():
 @app.route("/test-database")
 def test_database():
     """Тестирование работы PostgreSQL базы данных"""
+    conn = None
     try:
         # Проверяем подключение
         conn = get_db_connection()
@@ -2239,7 +3069,6 @@ def test_database():
         result = cur.fetchone()
         
         cur.close()
-        conn.close()
         
         if result:
             return jsonify({
@@ -2256,6 +3085,8 @@ def test_database():
             
     except Exception as e:
         return jsonify({"status": "error", "message": f"❌ Ошибка PostgreSQL: {str(e)}"})
+    finally:
+        release_db_connection(conn)
 
 @app.route("/test-file-save")
 def test_file_save():
@@ -2292,31 +3123,29 @@ def test_file_save():
 if __name__ == "__main__":
     print("🚀 Запуск инициализации базы знаний...")
     
-    # Инициализация базы знаний
-    if init_knowledge_db():
+    # Схема создается вместе с пулом при импорте модуля
+    if _KB_SCHEMA_READY:
         print("✅ PostgreSQL база инициализирована")
         # Загружаем данные из PostgreSQL
         load_knowledge_base()
         
         # 🔄 СИНХРОНИЗАЦИЯ: Обновляем файл из PostgreSQL
-        conn = get_db_connection()
-        if conn:
-            try:
-                cur = conn.cursor(cursor_factory=RealDictCursor)
-                cur.execute("SELECT question, answer FROM knowledge_base")
-                rows = cur.fetchall()
-                postgres_data = {row['question']: row['answer'] for row in rows}
+        with pg_conn() as conn:
+            if conn:
+                try:
+                    cur = conn.cursor(cursor_factory=RealDictCursor)
+                    cur.execute("SELECT question, answer FROM knowledge_base")
+                    rows = cur.fetchall()
+                    postgres_data = {row['question']: row['answer'] for row in rows}
                 
-                # Сохраняем актуальные данные в файл
-                with open(KNOWLEDGE_FILE, "w", encoding="utf-8") as f:
-                    json.dump(postgres_data, f, ensure_ascii=False, indent=4)
+                    # Сохраняем актуальные данные в файл
+                    write_json_file(KNOWLEDGE_FILE, postgres_data)
                 
-                print(f"✅ Файл синхронизирован с PostgreSQL ({len(postgres_data)} записей)")
+                    print(f"✅ Файл синхронизирован с PostgreSQL ({len(postgres_data)} записей)")
                 
-                cur.close()
-                conn.close()
-            except Exception as e:
-                print(f"❌ Ошибка синхронизации при запуске: {e}")
+                    cur.close()
+                except Exception as e:
+                    print(f"❌ Ошибка синхронизации при запуске: {e}")
     else:
         print("ℹ️  Используем файловую базу знаний")
         load_knowledge_base()
@@ -2334,5 +3163,7 @@ if __name__ == "__main__":
     print(f"   🖥️  В локальной сети: http://{local_ip}:{port}")
     print(f"   🔐  На этом устройстве: http://localhost:{port} или http://127.0.0.1:{port}")
     print("💡 Для остановки сервера нажмите CTRL+C")
+    print("ℹ️  Это сервер разработки; в продакшене: gunicorn -c gunicorn.conf.py web_app:app")
     
-    app.run(host="0.0.0.0", port=port, debug=debug)
+    # Каждый запрос в своем потоке: ожидание Yandex не блокирует остальных
+    app.run(host="0.0.0.0", port=port, debug=debug, threaded=True)